@@ -0,0 +1,47 @@
+"""
+Benchmarks SharedMemoryEvaluator against evaluating in one process.
+
+NumPy ufuncs run on one core, so transcendental-heavy formulas over large
+arrays should speed up close to linearly with the number of workers.
+
+Usage: python benchmarks/bench_parallel_eval.py [n_elements]
+"""
+import os
+import sys
+import time
+
+import numpy
+
+from latex_parser.parallel import SharedMemoryEvaluator
+from latex_parser.parser import compile_function
+
+_FORMULA = r"\sin(x)\exp(-\frac{x^{2}}{2}) + \arctan(\cosh(\frac{x}{10}))\log(1+x^{2})"
+
+
+def _time(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(n_elements: int):
+    function = compile_function(_FORMULA)
+    values = numpy.linspace(-10, 10, n_elements)
+    serial = _time(lambda: function(x=values))
+    print(f"serial      {serial:8.3f}s")
+    for n_workers in sorted({1, 2, 4, 8, os.cpu_count()}):
+        with SharedMemoryEvaluator(_FORMULA, n_workers=n_workers) as evaluator:
+            x = evaluator.allocate(n_elements)
+            x[:] = values
+            out = evaluator.allocate(n_elements)
+            # The first call starts the workers and compiles the formula in each
+            evaluator.evaluate(out=out, x=x)
+            parallel = _time(lambda: evaluator.evaluate(out=out, x=x))
+            del x, out
+        print(
+            f"workers={n_workers:<3d} {parallel:8.3f}s  speedup {serial / parallel:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 7)
@@ -0,0 +1,44 @@
+"""
+Benchmarks parse_parallel on one huge string against the serial parse.
+
+The string is a long sum, so it splits into as many terms as it has. Lexing takes more
+than linear time in the length of the string, so even one process beats the serial parse;
+beyond that, expect the speedup to grow with the number of processes, up to the number of CPUs.
+
+Usage: python benchmarks/bench_parse_split.py [n_terms]
+"""
+import os
+import sys
+import time
+
+from latex_parser.parser import parse, parse_parallel
+
+
+def _formula(n_terms: int) -> str:
+    return " - ".join(
+        rf"\sin(x_{{{idx}}}^{{2}}+{idx}) + \frac{{{idx}}}{{y}}" for idx in range(n_terms // 2)
+    )
+
+
+def _time(func) -> float:
+    parse.cache_clear()
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(n_terms: int):
+    formula = _formula(n_terms)
+    print(f"{len(formula)} characters, {os.cpu_count()} CPUs")
+
+    serial = _time(lambda: parse(formula))
+    print(f"serial        {serial:8.3f}s")
+    for max_workers in sorted({1, 2, 4, 8, os.cpu_count()}):
+        split = _time(lambda: parse_parallel(formula, max_workers=max_workers, min_length=0))
+        print(
+            f"processes={max_workers:<3d} {split:8.3f}s  speedup {serial / split:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
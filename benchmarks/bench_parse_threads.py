@@ -0,0 +1,46 @@
+"""
+Benchmarks parse_many on a thread pool against parsing in a loop.
+
+Threads only scale on a free-threaded (no-GIL) build of CPython,
+e.g. python3.13t. On a build with the GIL, expect a speedup of about 1x.
+
+Usage: python benchmarks/bench_parse_threads.py [n_formulas]
+"""
+import os
+import sys
+import time
+
+from latex_parser.parser import parse, parse_many
+
+
+def _formulas(n_formulas: int):
+    # Distinct strings, so the parse cache never hits
+    return [
+        rf"\sin(x_{{{idx}}}^{{2}}+{idx}) + \frac{{{idx}}}{{y}} - 3z({idx}+w)"
+        for idx in range(n_formulas)
+    ]
+
+
+def _time(func) -> float:
+    parse.cache_clear()
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(n_formulas: int):
+    formulas = _formulas(n_formulas)
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]}, GIL enabled: {gil_enabled}")
+
+    serial = _time(lambda: [parse(formula) for formula in formulas])
+    print(f"serial      {serial:8.3f}s")
+    for max_workers in [1, 2, 4, 8, os.cpu_count()]:
+        threaded = _time(lambda: parse_many(formulas, max_workers=max_workers))
+        print(
+            f"threads={max_workers:<3d} {threaded:8.3f}s  speedup {serial / threaded:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,7 +1,8 @@
-
 import re
-from typing import List
-from typing import Tuple
+from typing import Dict, List, Tuple
+
+from latex_parser.lexer import lex, token_type
+from latex_parser.utilities import NAMED_CONSTANTS, operand_count
 
 
 class ShuntingYardError(Exception):
@@ -29,88 +30,308 @@ class MismatchedParenthesesError(ShuntingYardError):
     pass
 
 
-def to_token_list(parse_str: str) -> Tuple[List[str], int]:
-    """
-    Transforms the preprocessed parse string into a list of tokens.
-    Also returns a 0 when tokenizing succeeded, or a 1 if it failed.
+class MalformedEnvironmentError(ShuntingYardError):
+    """Raised when an environment is unclosed, unsupported, or its cells do not form a grid"""
+    pass
 
-    Keyword arguments:
-    parse_str -- The preprocessed infix string to be tokenized.
-    """
-    valid_token_regex = re.compile(r'^((OP|LIT|VAR)[0-9]+|\(|\))')
-    token_list = []
-    while len(parse_str) > 0:
-        if valid_token_regex.match(parse_str):
-            token_end_idx = valid_token_regex.match(parse_str).span()[1]
-            next_token = parse_str[:token_end_idx]
-            parse_str = parse_str[token_end_idx:]
-            token_list.append(next_token)
-        else:
-            return ([parse_str], 1)
 
-    return (token_list, 0)
+# Operands and the token types that begin or end one.
+_OPERANDS = ["CONS", "VAR"]
+_OPERAND_STARTS = ["CONS", "VAR", "FUNC", "BINOP_PRFIX", "BIGOP", "MATRIX", "CASES", "LPAREN"]
+_OPERAND_ENDS = ["CONS", "VAR", "RPAREN"]
+
+# Prefix operators bind tighter than products, but looser than powers,
+# so that -x^2 is -(x^2). \frac, matrices and cases delimit all their operands so they bind
+# tightest. Big operators take products into their body, but not sums. Relations bind loosest.
+_INFIX_PRECEDENCE = {
+    "<": 0, ">": 0, "<=": 0, ">=": 0, "==": 0, "!=": 0,
+    "+": 1, "-": 1, "*": 3, "/": 3, "expt": 5,
+}
+_PREFIX_PRECEDENCE = {"BIGOP": 2, "FUNC": 4, "BINOP_PRFIX": 6, "MATRIX": 6, "CASES": 6}
+# The number of parenthesized operands that follow each prefix operator,
+# and whether an operand follows the last of them.
+_DELIMITED_OPERANDS = {"BINOP_PRFIX": (2, False), "BIGOP": (3, True)}
+_BIG_OPERATOR_REGEX = re.compile(
+    r"\\(?P<operator>sum|prod)_\{?\s*(?P<index>[a-zA-Z])\s*=(?P<lower>[^{}]+?)\}?"
+    r"\^\{?(?P<upper>[^{}]+?)\}?$"
+)
+_RIGHT_ASSOCIATIVE = ["expt"]
+_MATRIX_ENVIRONMENTS = ["matrix", "pmatrix", "bmatrix", "Bmatrix"]
+# Conditions of the last case that match whatever the other cases do not
+_OTHERWISE = ["otherwise", "else"]
+
+
+def _precedence(token: str, symbol_mapping: Dict[str, str]) -> int:
+    kind = token_type(token)
+    if kind == "BINOP_INFIX":
+        return _INFIX_PRECEDENCE[symbol_mapping[token]]
+    return _PREFIX_PRECEDENCE[kind]
+
+
+def _typed_symbols(
+    tokens: List[str], symbol_mapping: Dict[str, str]
+) -> List[Tuple[str, str]]:
+    typed_symbols = []
+    idx = 0
+    while idx < len(tokens):
+        kind = token_type(tokens[idx])
+        symbol = symbol_mapping.get(tokens[idx])
+        if kind == "FUNC" and symbol in NAMED_CONSTANTS:
+            kind = "CONS"
+        if kind == "TEXT":
+            # Annotations such as \text{if } carry no meaning
+            pass
+        elif kind == "BIGOP":
+            typed_symbols.extend(_big_operator_symbols(symbol))
+        elif kind == "ENV_BEGIN":
+            end_idx = _environment_end(tokens, idx)
+            typed_symbols.extend(
+                _environment_symbols(symbol, tokens[idx + 1:end_idx], symbol_mapping)
+            )
+            idx = end_idx
+        else:
+            typed_symbols.append((kind, symbol))
+        idx += 1
+    return typed_symbols
+
+
+def _environment_end(tokens: List[str], begin_idx: int) -> int:
+    depth = 0
+    for idx in range(begin_idx, len(tokens)):
+        kind = token_type(tokens[idx])
+        if kind == "ENV_BEGIN":
+            depth += 1
+        elif kind == "ENV_END":
+            depth -= 1
+            if depth == 0:
+                return idx
+    raise MalformedEnvironmentError("Environment was never ended!")
+
+
+def _environment_cells(tokens: List[str]) -> List[List[List[str]]]:
+    # Splits the body of an environment into rows of cells, at its own separators only
+    rows = [[[]]]
+    depth = 0
+    for token in tokens:
+        kind = token_type(token)
+        if kind in ["LPAREN", "ENV_BEGIN"]:
+            depth += 1
+        elif kind in ["RPAREN", "ENV_END"]:
+            depth -= 1
+        if depth == 0 and kind == "COLSEP":
+            rows[-1].append([])
+        elif depth == 0 and kind == "ROWSEP":
+            rows.append([[]])
+        else:
+            rows[-1][-1].append(token)
+    # A row separator may end the last row
+    if rows[-1] == [[]] and len(rows) > 1:
+        rows.pop()
+    return rows
+
+
+def _environment_symbols(
+    name: str, tokens: List[str], symbol_mapping: Dict[str, str]
+) -> List[Tuple[str, str]]:
+    if name == "cases":
+        return _cases_symbols(tokens, symbol_mapping)
+    # A matrix becomes MATRIX (a) (b) (c) (d), its cells in row-major order
+    if name not in _MATRIX_ENVIRONMENTS:
+        raise MalformedEnvironmentError(f"Unsupported environment {name}!")
+    rows = _environment_cells(tokens)
+    n_columns = len(rows[0])
+    if any(len(row) != n_columns for row in rows):
+        raise MalformedEnvironmentError(f"Rows of the {name} have different lengths!")
+    typed_symbols = [("MATRIX", f"{len(rows)}x{n_columns}")]
+    for row in rows:
+        for cell in row:
+            if not cell:
+                raise MalformedEnvironmentError(f"The {name} has an empty cell!")
+            typed_symbols.append(("LPAREN", None))
+            typed_symbols.extend(_typed_symbols(cell, symbol_mapping))
+            typed_symbols.append(("RPAREN", None))
+    return typed_symbols
+
+
+def _is_otherwise(cell: List[str], symbol_mapping: Dict[str, str]) -> bool:
+    # An empty condition, or words alone such as \text{otherwise}
+    if any(token_type(token) not in ["TEXT", "VAR"] for token in cell):
+        return False
+    words = {symbol_mapping[token].strip(" ,.:") for token in cell} - {""}
+    return words <= set(_OTHERWISE)
+
+
+def _cases_symbols(tokens: List[str], symbol_mapping: Dict[str, str]) -> List[Tuple[str, str]]:
+    # Cases become CASES (value) (condition) (value) (condition) ..., in order. The condition
+    # of a last row that says otherwise, or has none, is the literal 1, which always holds.
+    rows = _environment_cells(tokens)
+    typed_symbols = [("CASES", f"cases{len(rows)}")]
+    for row_idx, row in enumerate(rows):
+        if len(row) > 2 or not row[0]:
+            raise MalformedEnvironmentError("Cases must be a value, then & and a condition!")
+        condition = row[1] if len(row) == 2 else []
+        otherwise = _is_otherwise(condition, symbol_mapping)
+        if otherwise and row_idx != len(rows) - 1:
+            raise MalformedEnvironmentError("Only the last case can hold otherwise!")
+        typed_symbols.append(("LPAREN", None))
+        typed_symbols.extend(_typed_symbols(row[0], symbol_mapping))
+        typed_symbols.append(("RPAREN", None))
+        typed_symbols.append(("LPAREN", None))
+        if otherwise:
+            typed_symbols.append(("CONS", "1"))
+        else:
+            typed_symbols.extend(_typed_symbols(condition, symbol_mapping))
+        typed_symbols.append(("RPAREN", None))
+    return typed_symbols
 
 
-def shunting_yard(parse_str: str) -> str:
+def _big_operator_symbols(symbol: str) -> List[Tuple[str, str]]:
+    # \sum_{i=1}^{n} becomes BIGOP (i) (1) (n), with the bounds lexed in turn
+    match = _BIG_OPERATOR_REGEX.match(symbol)
+    if match is None:
+        raise UnknownTokenError(
+            f"Big operators need an index and both bounds, e.g. \\sum_{{i=1}}^{{n}}, not {symbol}"
+        )
+    typed_symbols = [
+        ("BIGOP", match.group("operator")),
+        ("LPAREN", None),
+        ("VAR", match.group("index")),
+        ("RPAREN", None),
+    ]
+    for bound in ["lower", "upper"]:
+        typed_symbols.append(("LPAREN", None))
+        typed_symbols.extend(_typed_symbols(*lex(match.group(bound))))
+        typed_symbols.append(("RPAREN", None))
+    return typed_symbols
+
+
+def normalise_tokens(
+    tokens: List[str], symbol_mapping: Dict[str, str]
+) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Rewrites a lexed token list so that it can be parsed without ambiguity.
+
+    Named constants become literals, unary signs become the neg function and
+    juxtaposed operands (2x, 2\\sin(x), (a)(b)) get an explicit product.
+    Big operators are followed by their index, lower and upper bound in parentheses.
+    Matrix environments become MATRIX operators, followed by their cells in parentheses,
+    and cases environments become CASES operators, followed by each value and condition.
+    Tokens are then renumbered by position, so the output only depends on the input.
+
+    :param tokens: the token list from the lexer
+    :param symbol_mapping: the mapping of tokens to symbols from the lexer
+    :return: the normalised token list and its symbol mapping
+    """
+    typed_symbols = []
+    previous = None
+    depth = 0
+    # Depths at which each open prefix operator expects its delimited operands,
+    # how many remain, and whether an operand follows the last of them
+    prefix_operands = []
+    operand_next = False
+
+    for kind, symbol in _typed_symbols(tokens, symbol_mapping):
+        if kind == "BINOP_INFIX" and symbol in ["+", "-"]:
+            if previous not in _OPERAND_ENDS:
+                if symbol == "-":
+                    typed_symbols.append(("FUNC", "neg"))
+                    previous = "FUNC"
+                continue
+
+        if kind in _OPERAND_STARTS and previous in _OPERAND_ENDS and not operand_next:
+            typed_symbols.append(("BINOP_INFIX", "*"))
+        operand_next = False
+
+        if kind in _DELIMITED_OPERANDS:
+            prefix_operands.append([depth, *_DELIMITED_OPERANDS[kind]])
+        elif kind in ["MATRIX", "CASES"]:
+            prefix_operands.append([depth, operand_count(kind, symbol), False])
+        elif kind == "LPAREN":
+            depth += 1
+        elif kind == "RPAREN":
+            depth -= 1
+            if prefix_operands and prefix_operands[-1][0] == depth:
+                prefix_operands[-1][1] -= 1
+                if prefix_operands[-1][1] == 0:
+                    operand_next = prefix_operands.pop()[2]
+                else:
+                    operand_next = True
+
+        typed_symbols.append((kind, symbol))
+        previous = kind
+
+    normalised_tokens = []
+    normalised_mapping = {}
+    counters = {}
+    for kind, symbol in typed_symbols:
+        if kind in ["LPAREN", "RPAREN"]:
+            normalised_tokens.append(kind)
+            continue
+        counters[kind] = counters.get(kind, 0) + 1
+        token = f"{kind}_{counters[kind]}"
+        normalised_tokens.append(token)
+        normalised_mapping[token] = symbol
+
+    return normalised_tokens, normalised_mapping
+
+
+def shunting_yard(tokens: List[str], symbol_mapping: Dict[str, str]) -> List[str]:
     """
     Implementation of the shunting yard algorithm.
 
     Assumptions:
-    The input is parenthesized to resolve operator precedence ambiguity.
-    The first and last characters are L and R parens respectively.
-    All literals have been replaced with LITx, where x is a positive integer.
-    All variables have been replaced with VARx, where x is a positive integer.
-    All operators have been replaced with OPx, where x is a positive integer.
-
-    Keyword arguments:
-    parse_str -- The preprocessed infix string to be parsed.
-    """
-
-    if parse_str[0] != "(" and parse_str[-1] != ")":
-        raise NoOuterParenthesesError(
-            "Input as prepared did not have outer parentheses!")
+    The input is a normalised token list, as returned by normalise_tokens.
+    Functions and prefix binary operators precede their operands.
+    Infix binary operators are resolved by precedence, then by associativity.
 
+    :param tokens: the normalised token list to be parsed
+    :param symbol_mapping: the mapping of tokens to symbols
+    :return: the tokens in reverse polish notation, without parentheses
+    """
     out_queue = []
     op_stack = []
 
-    in_queue, error = to_token_list(parse_str)
-    
-    if error:
-        raise UnknownTokenError(
-            "Encountered an unrecognized token!\
-            Lexer didn't catch {0}".format(in_queue[0]))
-
-    for token in in_queue:
-        if token[:3] in ['LIT', 'VAR']:
+    for token in tokens:
+        kind = token_type(token)
+        if kind in _OPERANDS:
             out_queue.append(token)
-        elif token[:2] == 'OP':
+        elif kind in _PREFIX_PRECEDENCE:
             op_stack.append(token)
-        elif token == '(':
+        elif kind == "BINOP_INFIX":
+            precedence = _precedence(token, symbol_mapping)
+            right_associative = symbol_mapping[token] in _RIGHT_ASSOCIATIVE
+            while op_stack and op_stack[-1] != "LPAREN":
+                top_precedence = _precedence(op_stack[-1], symbol_mapping)
+                if top_precedence < precedence:
+                    break
+                if top_precedence == precedence and right_associative:
+                    break
+                out_queue.append(op_stack.pop())
+            op_stack.append(token)
+        elif kind == "LPAREN":
             op_stack.append(token)
-        elif token == ')':
+        elif kind == "RPAREN":
             # Pop operators off the stack
             # until we find the matching parenthesis
-            while op_stack[-1] != '(':
-                if len(op_stack) == 0:
-                    raise MismatchedParenthesesError(
-                        "Emptied the stack while searching for a L_PAREN!")
+            while op_stack and op_stack[-1] != "LPAREN":
                 out_queue.append(op_stack.pop())
+            if not op_stack:
+                raise MismatchedParenthesesError(
+                    "Emptied the stack while searching for a L_PAREN!"
+                )
             # Pop off the left parenthesis
             op_stack.pop()
-    if len(op_stack) > 0:
-        raise OperatorsOnStackError(
-            "Operators left on stack at algorithm termination!")
+        else:
+            raise UnknownTokenError(
+                "Encountered an unrecognized token! Lexer didn't catch {0}".format(
+                    token
+                )
+            )
+
+    while op_stack:
+        if op_stack[-1] == "LPAREN":
+            raise MismatchedParenthesesError(
+                "Unclosed L_PAREN left on stack at algorithm termination!"
+            )
+        out_queue.append(op_stack.pop())
     return out_queue
-
-
-
-
-
-
-
-
-
-
-
-
-
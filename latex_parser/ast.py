@@ -1,59 +1,365 @@
 """
-AST factory class to create AST from rpn string
+AST factory class to create functions from rpn strings
 """
 
 import ast
 import math
+import operator
+from decimal import Decimal
+from fractions import Fraction
+from typing import Callable, Dict, Sequence, Tuple
 
 import numpy
 
+from latex_parser.utilities import free_names, rpn_to_ast
+
 symbol_mapping = {
     # Trig functions
-    'sin': math.sin,
-    'cos': math.cos,
-    'tan': math.tan,
-    'sec': math.sec,
-    'cot': math.cot,
-    'cosec': math.cosec,
+    'sin': numpy.sin,
+    'cos': numpy.cos,
+    'tan': numpy.tan,
+    'sec': lambda x: 1 / numpy.cos(x),
+    'cot': lambda x: 1 / numpy.tan(x),
+    'cosec': lambda x: 1 / numpy.sin(x),
+    'csc': lambda x: 1 / numpy.sin(x),
+    'arcsin': numpy.arcsin,
+    'arccos': numpy.arccos,
+    'arctan': numpy.arctan,
     # Hyperbolic trig functions
-    'sinh': math.sinh,
-    'cosh': math.cosh,
-    'tanh': math.tanh,
-    'sech': math.sech,
-    'coth': math.coth,
+    'sinh': numpy.sinh,
+    'cosh': numpy.cosh,
+    'tanh': numpy.tanh,
+    'sech': lambda x: 1 / numpy.cosh(x),
+    'coth': lambda x: 1 / numpy.tanh(x),
+    # Exponentials and logarithms
+    'exp': numpy.exp,
+    'nat_log': numpy.log,
+    'log': numpy.log10,
+    'sqrt': numpy.sqrt,
     #  Functions
     'abs': abs,
     'pow': pow,
     'max': max,
     'min': min,
-    
     }
 
-class FunctionTreeFactory:
-    def __init__():
-        pass
+
+def _numpy_coercion(dtype: type) -> Callable:
+    def _coerce(value):
+        array = numpy.asarray(value, dtype=dtype)
+        # Keep scalars as numpy scalars rather than 0-d arrays
+        return array if array.ndim else array[()]
+    return _coerce
+
+
+def _to_fraction(value) -> Fraction:
+    # Floats are taken to mean their shortest decimal repr, so 0.1 is 1/10
+    return Fraction(repr(value)) if isinstance(value, float) else Fraction(value)
+
+
+def _to_decimal(value) -> Decimal:
+    return Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+
+
+coercions = {
+    'float32': _numpy_coercion(numpy.float32),
+    'float64': _numpy_coercion(numpy.float64),
+    'complex128': _numpy_coercion(numpy.complex128),
+    'float': float,
+    'fraction': _to_fraction,
+    'decimal': _to_decimal,
+    }
+
+# The most index values times elements per index value evaluated at once by a reduction
+_REDUCTION_CHUNK_SIZE = 1 << 20
+
+
+def _index_bounds(value) -> numpy.ndarray:
+    value = numpy.asarray(value)
+    if numpy.iscomplexobj(value):
+        if numpy.any(value.imag != 0):
+            raise ValueError(f"Bounds of big operators must be real, not {value}")
+        value = value.real
+    bounds = value.astype(numpy.int64)
+    if numpy.any(bounds != value):
+        raise ValueError(f"Bounds of big operators must be integers, not {value}")
+    return bounds
+
+
+def _numpy_reduction(ufunc: numpy.ufunc, dtype: type) -> Callable:
+    def _reduce(function: Callable, lower, upper, *context):
+        """
+        Reduces function(i) over lower <= i <= upper, one vectorized pass per chunk of i.
+        The index runs along a new leading axis, broadcast against the other variables.
+        Bounds that are arrays, e.g. the index of an outer sum, mask the terms out of range.
+        The index is converted to the dtype, so with float32 indices above 2**24 are rounded.
+        """
+        lower, upper = _index_bounds(lower), _index_bounds(upper)
+        shape = numpy.broadcast_shapes(
+            lower.shape, upper.shape, *[numpy.shape(value) for value in context]
+        )
+        masked = bool(lower.ndim or upper.ndim)
+        chunk_length = max(1, _REDUCTION_CHUNK_SIZE // max(1, math.prod(shape)))
+        index_shape = (-1,) + (1,) * len(shape)
+
+        result = numpy.full(shape, ufunc.identity, dtype=dtype)
+        for start in range(int(lower.min()), int(upper.max()) + 1, chunk_length):
+            stop = min(start + chunk_length, int(upper.max()) + 1)
+            index = numpy.arange(start, stop).reshape(index_shape)
+            terms = numpy.broadcast_to(
+                function(index.astype(dtype)), (stop - start,) + shape
+            )
+            if masked:
+                in_range = (index >= lower) & (index <= upper)
+                terms = numpy.where(in_range, terms, dtype(ufunc.identity))
+            result = ufunc(result, ufunc.reduce(terms, axis=0))
+        return result if shape else result[()]
+    return _reduce
+
+
+def _exact_reduction(combine: Callable, identity: int, coerce: Callable) -> Callable:
+    def _reduce(function: Callable, lower, upper, *context):
+        result = coerce(identity)
+        for index in range(int(_index_bounds(lower)), int(_index_bounds(upper)) + 1):
+            result = combine(result, function(coerce(index)))
+        return result
+    return _reduce
+
+
+def _numpy_piecewise(dtype: type) -> Callable:
+    def _piecewise(branches: Sequence[Tuple[Callable, Callable]], *context):
+        """
+        Evaluates cases, each condition and value only on the elements that reach it.
+        The elements still undecided are compressed out of the context arrays before each
+        condition, and the elements a case takes before its value, which is then scattered
+        into the result. Elements no case takes are nan.
+        """
+        shape = numpy.broadcast_shapes(*[numpy.shape(value) for value in context])
+        if not shape:
+            return _scalar_piecewise(branches, *context, default=dtype(numpy.nan))
+        columns = [numpy.broadcast_to(value, shape).reshape(-1) for value in context]
+        result = numpy.full(math.prod(shape), numpy.nan, dtype=dtype)
+        remaining = numpy.arange(result.size)
+        for condition, value in branches:
+            holds = condition(*[column[remaining] for column in columns])
+            mask = numpy.broadcast_to(numpy.asarray(holds, dtype=bool), remaining.shape)
+            taken = remaining[mask]
+            if taken.size:
+                result[taken] = value(*[column[taken] for column in columns])
+            remaining = remaining[~mask]
+            if not remaining.size:
+                break
+        return result.reshape(shape)
+    return _piecewise
+
+
+def _scalar_piecewise(branches: Sequence[Tuple[Callable, Callable]], *context, default=None):
+    for condition, value in branches:
+        if condition(*context):
+            return value(*context)
+    if default is None:
+        raise ValueError("No case applies!")
+    return default
+
+
+def _matrix(rows: Sequence[Sequence]) -> numpy.ndarray:
+    """
+    Stacks matrix cells into an array of shape (..., rows, columns).
+    Cells that are arrays give a batch of matrices, so products are one batched matmul.
+    """
+    cells = numpy.broadcast_arrays(*[cell for row in rows for cell in row])
+    stacked = numpy.stack(cells, axis=-1)
+    return stacked.reshape(stacked.shape[:-1] + (len(rows), len(rows[0])))
+
+
+def _matrix_operand(value) -> numpy.ndarray:
+    # Broadcasts a (batch of) scalars over the entries of a (batch of) matrices
+    return numpy.asarray(value)[..., numpy.newaxis, numpy.newaxis]
 
 
-    def create_trig_function(symbol: str):
-        if symbol == 'sin':
-            function = math.sin
-        if symbol == 'cos':
-            function = math.cos
-        if symbol == 'tan':
-            function = math.tan
-        ast.Lambda(
-        pass
+def _matrix_power(matrix: numpy.ndarray, exponent) -> numpy.ndarray:
+    if numpy.ndim(exponent) != 0 or int(exponent) != exponent:
+        raise ValueError(f"Matrices can only be raised to integer powers, not {exponent}")
+    return numpy.linalg.matrix_power(matrix, int(exponent))
+
+
+_matrix_functions = {
+    'matrix': _matrix,
+    'matrix_operand': _matrix_operand,
+    'matrix_power': _matrix_power,
+    }
+
+
+def _numpy_functions(dtype: type) -> Dict[str, Callable]:
+    return dict(
+        symbol_mapping,
+        **_matrix_functions,
+        sum_reduce=_numpy_reduction(numpy.add, dtype),
+        prod_reduce=_numpy_reduction(numpy.multiply, dtype),
+        piecewise=_numpy_piecewise(dtype),
+    )
+
+
+def _exact_functions(coerce: Callable) -> Dict[str, Callable]:
+    # Python numbers have no trig, so exact types only support what they can compute exactly
+    return {
+        **_matrix_functions,
+        'abs': abs,
+        'pow': pow,
+        'max': max,
+        'min': min,
+        'sum_reduce': _exact_reduction(operator.add, 0, coerce),
+        'prod_reduce': _exact_reduction(operator.mul, 1, coerce),
+        'piecewise': _scalar_piecewise,
+        }
+
+
+def _scalar_functions() -> Dict[str, Callable]:
+    # Python floats and the math module, which beat NumPy on one value at a time
+    return dict(
+        _exact_functions(float),
+        sin=math.sin,
+        cos=math.cos,
+        tan=math.tan,
+        sec=lambda x: 1 / math.cos(x),
+        cot=lambda x: 1 / math.tan(x),
+        cosec=lambda x: 1 / math.sin(x),
+        csc=lambda x: 1 / math.sin(x),
+        arcsin=math.asin,
+        arccos=math.acos,
+        arctan=math.atan,
+        sinh=math.sinh,
+        cosh=math.cosh,
+        tanh=math.tanh,
+        sech=lambda x: 1 / math.cosh(x),
+        coth=lambda x: 1 / math.tanh(x),
+        exp=math.exp,
+        nat_log=math.log,
+        log=math.log10,
+        sqrt=math.sqrt,
+    )
+
+
+function_tables = {
+    'float32': _numpy_functions(numpy.float32),
+    'float64': _numpy_functions(numpy.float64),
+    'complex128': _numpy_functions(numpy.complex128),
+    'float': _scalar_functions(),
+    'fraction': _exact_functions(_to_fraction),
+    'decimal': dict(
+        _exact_functions(_to_decimal),
+        sqrt=Decimal.sqrt,
+        exp=Decimal.exp,
+        nat_log=Decimal.ln,
+        log=Decimal.log10,
+    ),
+    }
+
+DTYPES = list(function_tables)
+
+# The dtypes that compute on NumPy arrays, and their NumPy types
+numpy_dtypes = {
+    'float32': numpy.float32,
+    'float64': numpy.float64,
+    'complex128': numpy.complex128,
+    }
+
+
+def free_variables(rpn: Sequence[str], symbol_mapping: Dict[str, str]) -> Tuple[str, ...]:
+    """
+    Gets the variables an expression depends on.
+
+    :param rpn: the tokens in reverse polish notation
+    :param symbol_mapping: the mapping of tokens to symbols
+    :return: the variable names, in order of first appearance
+    """
+    return free_names(rpn_to_ast(rpn, symbol_mapping))
+
+
+class _LiteralBinder(ast.NodeTransformer):
+    """
+    Replaces literals with names bound to constants of the dtype.
+    """
+
+    def __init__(self, coerce: Callable):
+        self.coerce = coerce
+        self.literals = {}
+
+    def visit_Constant(self, node: ast.Constant) -> ast.Name:
+        name = f"_literal_{len(self.literals)}"
+        self.literals[name] = self.coerce(node.value)
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+
+class FunctionTreeFactory:
+    """
+    Creates Python functions of the free variables of an expression.
 
-    def create_
-        
-    
-    def create_AST(rpn_string: str)-> ast.AST:
-        
-        
-        pass
+    The dtype selects the number type the function computes in: float32, float64,
+    complex128, float (Python floats, one value at a time), fraction or decimal.
+    Literals are converted to it once, when the function is created, and arguments
+    are converted to it on each call.
+    """
 
+    def __init__(self, function_table: Dict[str, Callable] = None, dtype: str = "float64"):
+        if dtype not in function_tables:
+            raise ValueError(f"Unsupported dtype {dtype}, expected one of {DTYPES}")
+        if function_table is None:
+            function_table = function_tables[dtype]
+        self.function_table = function_table
+        self.dtype = dtype
 
+    def create_AST(self, rpn: Sequence[str], symbol_mapping: Dict[str, str]) -> ast.Expression:
+        """
+        :param rpn: the tokens in reverse polish notation
+        :param symbol_mapping: the mapping of tokens to symbols
+        :return: a lambda of the free variables that evaluates the expression
+        """
+        expression = rpn_to_ast(rpn, symbol_mapping)
+        arguments = ast.arguments(
+            posonlyargs=[],
+            args=[ast.arg(arg=name) for name in free_names(expression)],
+            kwonlyargs=[],
+            kw_defaults=[],
+            defaults=[],
+        )
+        function = ast.Lambda(args=arguments, body=expression.body)
+        return ast.fix_missing_locations(ast.Expression(body=function))
 
+    def create_function(self, rpn: Sequence[str], symbol_mapping: Dict[str, str]) -> Callable:
+        """
+        :param rpn: the tokens in reverse polish notation
+        :param symbol_mapping: the mapping of tokens to symbols
+        :return: the compiled function, taking the free variables as arguments
+        """
+        tree = self.create_AST(rpn, symbol_mapping)
+        namespace = dict(self.function_table)
+        coerce = coercions[self.dtype]
 
+        literal_binder = _LiteralBinder(coerce)
+        tree = literal_binder.visit(tree)
+        namespace.update(literal_binder.literals)
 
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and node.func.id not in namespace:
+                raise ValueError(
+                    f"Function {node.func.id} is not supported for dtype {self.dtype}"
+                )
 
+        # lambda x, y: (lambda x, y: body)(_coerce(x), _coerce(y))
+        function = tree.body
+        namespace["_coerce"] = coerce
+        function.body = ast.Call(
+            func=ast.Lambda(args=function.args, body=function.body),
+            args=[
+                ast.Call(
+                    func=ast.Name(id="_coerce", ctx=ast.Load()),
+                    args=[ast.Name(id=argument.arg, ctx=ast.Load())],
+                    keywords=[],
+                )
+                for argument in function.args.args
+            ],
+            keywords=[],
+        )
+        code = compile(ast.fix_missing_locations(tree), "<latex>", "eval")
+        return eval(code, namespace)
@@ -0,0 +1,428 @@
+"""
+Automatic choice of how to evaluate a formula, from a cost model of the formula and its input.
+
+There are four backends:
+
+    tree      -- walks the expression tree with Python floats, no compilation
+    python    -- the formula compiled to a Python function of floats, called per element
+    numpy     -- the formula compiled to NumPy, called once on the whole arrays
+    parallel  -- NumPy on slices of the arrays in worker processes, see latex_parser.parallel
+
+Each backend's cost is modelled as a fixed cost per call plus a cost per element, both linear
+in the number of nodes and the number of transcendental functions in the formula. The unit
+costs are measured by a short microbenchmark the first time they are needed, and saved to
+$XDG_CACHE_HOME/latex_parser/calibration.json (~/.cache by default) for later runs.
+"""
+import ast
+import json
+import math
+import operator
+import os
+import sys
+import time
+from typing import Any, Callable, Collection, Dict, NamedTuple, Optional
+
+import numpy
+
+from latex_parser.ast import FunctionTreeFactory, function_tables
+from latex_parser.lexer import token_type
+from latex_parser.parallel import SharedMemoryEvaluator
+from latex_parser.parser import compile_function, parse
+from latex_parser.utilities import function_name, operand_count, rpn_to_ast
+
+BACKENDS = ["tree", "python", "numpy", "parallel"]
+
+_TRANSCENDENTAL_FUNCTIONS = {
+    "sin", "cos", "tan", "sec", "cot", "cosec", "csc", "arcsin", "arccos", "arctan",
+    "sinh", "cosh", "tanh", "sech", "coth", "exp", "nat_log", "log", "sqrt",
+}
+_CALIBRATION_VERSION = 1
+# Starting the workers is not measured; this is the round trip of a warm pool
+_PROCESS_OVERHEAD = 5e-3
+# The formula the unit costs are measured on
+_CALIBRATION_FORMULA = r"\sin(x)x^{2} - \frac{\exp(x)}{3} + 2x"
+
+
+class FormulaFeatures(NamedTuple):
+    """The shape of a formula's tree, as far as the cost model cares"""
+
+    n_nodes: int
+    n_transcendental: int
+    depth: int
+    # sums and products, whose bodies are evaluated once per value of the index
+    n_big_operators: int = 0
+
+
+class Calibration(NamedTuple):
+    """Unit costs on this machine, in seconds"""
+
+    tree_node: float  # walking one node for one element
+    python_node: float  # one node of a compiled Python function, for one element
+    math_transcendental: float  # one math module call
+    numpy_call: float  # the fixed overhead of one NumPy call, per node
+    numpy_node: float  # one node of a NumPy function, per array element
+    numpy_transcendental: float  # one NumPy transcendental ufunc, per array element
+    compile_node: float  # compiling one node
+    copy_element: float  # copying one element into shared memory
+    n_cpus: int
+
+
+class BackendChoice(NamedTuple):
+    """The backend chosen for a call, and why"""
+
+    backend: str
+    n_elements: int
+    features: FormulaFeatures
+    # backend -> estimated seconds, for the backends that could run the call
+    estimates: Dict[str, float]
+
+
+def formula_features(parse_string: str) -> FormulaFeatures:
+    """
+    :param parse_string: the latex of a formula
+    :return: its node count, number of transcendental functions, tree depth and number
+    of big operators
+    """
+    parse_result = parse(parse_string)
+    depths = []
+    n_transcendental = 0
+    n_big_operators = 0
+    for token in parse_result.rpn:
+        kind = token_type(token)
+        symbol = parse_result.symbol_mapping[token]
+        if kind == "FUNC" and function_name(symbol) in _TRANSCENDENTAL_FUNCTIONS:
+            n_transcendental += 1
+        elif kind == "BIGOP":
+            n_big_operators += 1
+        arity = operand_count(kind, symbol)
+        operand_depths = [depths.pop() for _ in range(arity)]
+        depths.append(1 + max(operand_depths, default=0))
+    return FormulaFeatures(
+        len(parse_result.rpn), n_transcendental, max(depths, default=0), n_big_operators
+    )
+
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.MatMult: operator.matmul,
+    ast.BitAnd: operator.and_,
+}
+_RELATIONS = {
+    ast.Lt: operator.lt,
+    ast.Gt: operator.gt,
+    ast.LtE: operator.le,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+
+def walk(node: ast.AST, values: Dict[str, Any], function_table: Dict[str, Callable]) -> Any:
+    """
+    Evaluates an expression tree by walking it.
+
+    :param node: a node of a tree from rpn_to_ast
+    :param values: the values of the variables in scope
+    :param function_table: the functions the tree calls, from ast.function_tables
+    :return: the value of the node
+    """
+    if isinstance(node, ast.Expression):
+        return walk(node.body, values, function_table)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return values[node.id]
+    if isinstance(node, ast.BinOp):
+        return _BINARY_OPERATORS[type(node.op)](
+            walk(node.left, values, function_table), walk(node.right, values, function_table)
+        )
+    if isinstance(node, ast.UnaryOp):
+        return -walk(node.operand, values, function_table)
+    if isinstance(node, ast.Compare):
+        return _RELATIONS[type(node.ops[0])](
+            walk(node.left, values, function_table),
+            walk(node.comparators[0], values, function_table),
+        )
+    if isinstance(node, ast.List):
+        return [walk(element, values, function_table) for element in node.elts]
+    if isinstance(node, ast.Tuple):
+        return tuple(walk(element, values, function_table) for element in node.elts)
+    if isinstance(node, ast.Lambda):
+        names = [argument.arg for argument in node.args.args]
+        return lambda *arguments: walk(
+            node.body, dict(values, **dict(zip(names, arguments))), function_table
+        )
+    if isinstance(node, ast.Call):
+        return function_table[node.func.id](
+            *[walk(argument, values, function_table) for argument in node.args]
+        )
+    raise ValueError(f"Cannot evaluate {type(node).__name__} nodes!")
+
+
+def _per_call(function: Callable, n_calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        function()
+    return (time.perf_counter() - start) / n_calls
+
+
+def _measure() -> Calibration:
+    features = formula_features(_CALIBRATION_FORMULA)
+    parse_result = parse(_CALIBRATION_FORMULA)
+    tree = rpn_to_ast(parse_result.rpn, parse_result.symbol_mapping)
+    scalar_function = compile_function(_CALIBRATION_FORMULA, "float")
+    numpy_function = compile_function(_CALIBRATION_FORMULA)
+    scalar_table = function_tables["float"]
+    array = numpy.linspace(0.5, 1.5, 1 << 16)
+    one_element = array[:1]
+
+    math_transcendental = _per_call(lambda: math.sin(0.5), 20000)
+    numpy_transcendental = _per_call(lambda: numpy.sin(array), 20) / len(array)
+    scalar_transcendental = features.n_transcendental * math_transcendental
+    tree_node = (
+        _per_call(lambda: walk(tree, {"x": 0.5}, scalar_table), 2000) - scalar_transcendental
+    ) / features.n_nodes
+    python_node = (
+        _per_call(lambda: scalar_function(0.5), 5000) - scalar_transcendental
+    ) / features.n_nodes
+    numpy_call = _per_call(lambda: numpy_function(one_element), 2000) / features.n_nodes
+    numpy_node = (
+        _per_call(lambda: numpy_function(array), 20) / len(array)
+        - features.n_transcendental * numpy_transcendental
+    ) / features.n_nodes
+    compile_node = _per_call(
+        lambda: FunctionTreeFactory().create_function(
+            parse_result.rpn, parse_result.symbol_mapping
+        ),
+        50,
+    ) / features.n_nodes
+    target = numpy.empty_like(array)
+    copy_element = _per_call(lambda: numpy.copyto(target, array), 50) / len(array)
+
+    # Differences of timings can come out negative on a noisy machine
+    return Calibration(
+        tree_node=max(tree_node, 1e-8),
+        python_node=max(python_node, 1e-9),
+        math_transcendental=math_transcendental,
+        numpy_call=numpy_call,
+        numpy_node=max(numpy_node, 1e-10),
+        numpy_transcendental=numpy_transcendental,
+        compile_node=compile_node,
+        copy_element=copy_element,
+        n_cpus=os.cpu_count() or 1,
+    )
+
+
+def _calibration_path() -> str:
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "latex_parser", "calibration.json")
+
+
+def _environment() -> Dict[str, Any]:
+    return {
+        "version": _CALIBRATION_VERSION,
+        "python": sys.version,
+        "numpy": numpy.__version__,
+        "n_cpus": os.cpu_count() or 1,
+    }
+
+
+_calibration: Optional[Calibration] = None
+
+
+def calibrate(force: bool = False) -> Calibration:
+    """
+    Loads the unit costs for this machine, measuring and saving them if there are none.
+
+    :param force: measure again, even if saved costs exist
+    :return: the unit costs
+    """
+    global _calibration
+    if _calibration is not None and not force:
+        return _calibration
+    path = _calibration_path()
+    if not force:
+        try:
+            with open(path, encoding="utf-8") as calibration_file:
+                saved = json.load(calibration_file)
+            if saved["environment"] == _environment():
+                _calibration = Calibration(**saved["costs"])
+                return _calibration
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    _calibration = _measure()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as calibration_file:
+            json.dump(
+                {"environment": _environment(), "costs": _calibration._asdict()},
+                calibration_file,
+                indent=2,
+            )
+    except OSError:
+        # A read-only home only costs measuring again next run
+        pass
+    return _calibration
+
+
+def estimate_costs(
+    features: FormulaFeatures,
+    n_elements: int,
+    calibration: Calibration,
+    n_arrays: int = 1,
+    compiled: Collection[str] = BACKENDS,
+) -> Dict[str, float]:
+    """
+    Estimates the seconds each backend takes to evaluate a formula.
+
+    :param features: the formula's features
+    :param n_elements: the number of elements evaluated
+    :param calibration: the unit costs
+    :param n_arrays: the number of array arguments, which the parallel backend copies
+    :param compiled: the backends whose compiled function is already built
+    :return: backend -> estimated seconds
+    """
+    n_nodes, n_transcendental, depth, n_big_operators = features
+    compile_cost = n_nodes * calibration.compile_node
+    numpy_element = (
+        n_nodes * calibration.numpy_node + n_transcendental * calibration.numpy_transcendental
+    )
+    math_cost = n_transcendental * calibration.math_transcendental
+    estimates = {}
+    # The scalar backends loop over the index of a big operator in Python, for as many values
+    # as its bounds span, which the model cannot see; NumPy evaluates the body on an array
+    # of the indices instead. So formulas with sums or products always go to NumPy.
+    if not n_big_operators:
+        # The walk recurses, one or two frames per level of the tree
+        if 2 * depth < sys.getrecursionlimit() // 2:
+            estimates["tree"] = n_elements * (n_nodes * calibration.tree_node + math_cost)
+        estimates["python"] = n_elements * (n_nodes * calibration.python_node + math_cost)
+    estimates["numpy"] = n_nodes * calibration.numpy_call + n_elements * numpy_element
+    if calibration.n_cpus > 1:
+        estimates["parallel"] = (
+            _PROCESS_OVERHEAD
+            + n_elements * (n_arrays + 1) * calibration.copy_element
+            + n_elements * numpy_element / calibration.n_cpus
+        )
+    for backend in ["python", "numpy", "parallel"]:
+        if backend in estimates and backend not in compiled:
+            estimates[backend] += compile_cost
+    return estimates
+
+
+class AutoFunction:
+    """
+    A formula as a function of its free variables, evaluated by whichever backend the cost
+    model expects to be fastest for the size of each call's arguments. Computes in float64.
+
+        function = AutoFunction(r"\\sin(x)y")
+        function(x=0.5, y=2.0)  # one element: the tree or python backend
+        function(x=numpy.linspace(0, 1, 10 ** 8), y=2.0)  # numpy, or parallel
+        function.choose(x=0.5, y=2.0)  # the decision, without evaluating
+    """
+
+    def __init__(self, parse_string: str, calibration: Optional[Calibration] = None):
+        self.parse_string = parse_string
+        self.features = formula_features(parse_string)
+        self.calibration = calibration
+        self.last_choice: Optional[BackendChoice] = None
+        parse_result = parse(parse_string)
+        self._tree = rpn_to_ast(parse_result.rpn, parse_result.symbol_mapping)
+        self._functions: Dict[str, Callable] = {}
+        self._compiled = set()
+        self._evaluator: Optional[SharedMemoryEvaluator] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stops the worker processes, if the parallel backend was used.
+        """
+        if self._evaluator is not None:
+            self._evaluator.close()
+            self._evaluator = None
+
+    def choose(self, **values) -> BackendChoice:
+        """
+        :param values: the free variables
+        :return: the backend a call with these arguments would use
+        """
+        if self.calibration is None:
+            self.calibration = calibrate()
+        shapes = [numpy.shape(value) for value in values.values()]
+        n_elements = math.prod(numpy.broadcast_shapes(*shapes))
+        estimates = estimate_costs(
+            self.features,
+            n_elements,
+            self.calibration,
+            n_arrays=sum(1 for shape in shapes if shape),
+            compiled=self._compiled,
+        )
+        # Workers split the first axis of one dimensional arrays only
+        if "parallel" in estimates and not (
+            all(len(shape) == 1 for shape in shapes if shape)
+            and len({shape for shape in shapes if shape}) == 1
+        ):
+            del estimates["parallel"]
+        backend = min(estimates, key=estimates.get)
+        return BackendChoice(backend, n_elements, self.features, estimates)
+
+    def _function(self, backend: str) -> Callable:
+        self._compiled.add(backend)
+        if backend not in self._functions:
+            self._functions[backend] = compile_function(
+                self.parse_string, "float" if backend == "python" else "float64"
+            )
+        return self._functions[backend]
+
+    def _scalar_loop(self, evaluate: Callable[[Dict[str, float]], Any], values) -> Any:
+        names = list(values)
+        shape = numpy.broadcast_shapes(*[numpy.shape(value) for value in values.values()])
+        if not shape:
+            return numpy.float64(evaluate({name: float(values[name]) for name in names}))
+        columns = [
+            numpy.broadcast_to(numpy.asarray(values[name], dtype=numpy.float64), shape).flat
+            for name in names
+        ]
+        results = numpy.array(
+            [evaluate(dict(zip(names, map(float, row)))) for row in zip(*columns)],
+            dtype=numpy.float64,
+        )
+        return results.reshape(shape + results.shape[1:])
+
+    def __call__(self, **values) -> Any:
+        choice = self.choose(**values)
+        self.last_choice = choice
+        if choice.backend == "parallel":
+            if self._evaluator is None:
+                self._evaluator = SharedMemoryEvaluator(
+                    self.parse_string, n_workers=self.calibration.n_cpus
+                )
+            self._compiled.add("parallel")
+            shared = self._evaluator.evaluate(**values)
+            result = numpy.array(shared)
+            self._evaluator.release(shared)
+            return result
+        if choice.backend == "numpy":
+            return self._function("numpy")(**values)
+
+        if choice.backend == "tree":
+            table = function_tables["float"]
+            evaluate = lambda row: walk(self._tree, row, table)  # noqa: E731
+        else:
+            function = self._function("python")
+            evaluate = lambda row: function(**row)  # noqa: E731
+        try:
+            return self._scalar_loop(evaluate, values)
+        except (ArithmeticError, ValueError, TypeError):
+            # Python floats raise on domain errors, or go complex, where NumPy gives nan or inf
+            return self._function("numpy")(**values)
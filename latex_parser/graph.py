@@ -0,0 +1,187 @@
+"""
+Dependency graph of named formulas, recomputed incrementally.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+from latex_parser.ast import free_variables
+from latex_parser.parser import compile_function, parse
+from latex_parser.utilities import variable_name
+
+
+class FormulaCycleError(Exception):
+    """Raised when formulas depend on each other in a cycle"""
+    pass
+
+
+class FormulaGraph:
+    """
+    A set of named formulas, where a formula's result can be a variable of another.
+
+    Results are memoized. Changing an input only recomputes the formulas downstream of it,
+    so the cost of an update scales with the change and not with the number of formulas.
+    """
+
+    def __init__(self, dtype: str = "float64"):
+        self.dtype = dtype
+        self._functions: Dict[str, Callable] = {}
+        self._arguments: Dict[str, Tuple[str, ...]] = {}
+        # symbol -> formulas whose variables include the symbol
+        self._dependents: Dict[str, Set[str]] = {}
+        self._inputs: Dict[str, Any] = {}
+        self._values: Dict[str, Any] = {}
+        self._dirty: Set[str] = set()
+        # formula -> position in a topological order, rebuilt after structural changes
+        self._ranks: Dict[str, int] = {}
+
+    def set_formula(self, name: str, parse_string: str):
+        """
+        Adds or replaces a formula.
+
+        :param name: the symbol the formula's result is bound to, e.g. y or x_{1}
+        :param parse_string: the latex of the formula
+        """
+        name = variable_name(name)
+        if name in self._inputs:
+            raise ValueError(f"{name} is already an input!")
+        parse_result = parse(parse_string)
+        arguments = free_variables(parse_result.rpn, parse_result.symbol_mapping)
+        function = compile_function(parse_string, self.dtype)
+        if name in self._functions:
+            self._unlink(name)
+
+        self._functions[name] = function
+        self._arguments[name] = arguments
+        for argument in arguments:
+            self._dependents.setdefault(argument, set()).add(name)
+
+        self._ranks = {}
+        self._mark_dirty([name])
+        self._dirty.add(name)
+
+    def remove_formula(self, name: str):
+        """
+        :param name: the formula to remove
+        """
+        name = variable_name(name)
+        if name not in self._functions:
+            raise ValueError(f"{name} is not a formula!")
+        self._unlink(name)
+        self._values.pop(name, None)
+        self._dirty.discard(name)
+        self._ranks = {}
+        self._mark_dirty([name])
+
+    def _unlink(self, name: str):
+        for argument in self._arguments.pop(name):
+            self._dependents[argument].discard(name)
+        del self._functions[name]
+
+    def set_inputs(self, **values):
+        """
+        Binds values to input symbols, marking everything downstream of them as stale.
+
+        :param values: the input values, keyed by symbol
+        """
+        values = {variable_name(name): value for name, value in values.items()}
+        for name in values:
+            if name in self._functions:
+                raise ValueError(f"{name} is a formula, not an input!")
+        self._inputs.update(values)
+        self._mark_dirty(values)
+
+    def _mark_dirty(self, symbols: Iterable[str]):
+        pending = list(symbols)
+        while pending:
+            for dependent in self._dependents.get(pending.pop(), ()):
+                if dependent not in self._dirty:
+                    self._dirty.add(dependent)
+                    pending.append(dependent)
+
+    def downstream(self, *symbols: str) -> Set[str]:
+        """
+        :param symbols: the symbols that changed
+        :return: the formulas that depend on any of the symbols, directly or indirectly
+        """
+        found = set()
+        pending = [variable_name(symbol) for symbol in symbols]
+        while pending:
+            for dependent in self._dependents.get(pending.pop(), ()):
+                if dependent not in found:
+                    found.add(dependent)
+                    pending.append(dependent)
+        return found
+
+    def topological_order(self) -> List[str]:
+        """
+        Orders the formulas so that every formula comes after the formulas it depends on.
+
+        :return: the formula names in order
+        """
+        if len(self._ranks) != len(self._functions):
+            self._ranks = self._rank_formulas()
+        return sorted(self._ranks, key=self._ranks.get)
+
+    def _rank_formulas(self) -> Dict[str, int]:
+        # Kahn's algorithm over the formula -> formula edges
+        in_degree = {
+            name: sum(argument in self._functions for argument in arguments)
+            for name, arguments in self._arguments.items()
+        }
+        ready = [name for name, degree in in_degree.items() if degree == 0]
+        ranks = {}
+        while ready:
+            name = ready.pop()
+            ranks[name] = len(ranks)
+            for dependent in self._dependents.get(name, ()):
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(ranks) != len(self._functions):
+            cycle = sorted(set(self._functions) - set(ranks))
+            raise FormulaCycleError(f"Formulas depend on each other in a cycle: {cycle}")
+        return ranks
+
+    def recompute(self) -> Set[str]:
+        """
+        Recomputes the stale formulas, in dependency order.
+
+        :return: the names of the recomputed formulas
+        """
+        if not self._dirty:
+            return set()
+        if len(self._ranks) != len(self._functions):
+            self._ranks = self._rank_formulas()
+
+        recomputed = set()
+        for name in sorted(self._dirty, key=self._ranks.get):
+            arguments = []
+            for argument in self._arguments[name]:
+                if argument in self._values:
+                    arguments.append(self._values[argument])
+                elif argument in self._inputs:
+                    arguments.append(self._inputs[argument])
+                else:
+                    raise NameError(f"Formula {name} depends on unbound symbol {argument}!")
+            self._values[name] = self._functions[name](*arguments)
+            self._dirty.discard(name)
+            recomputed.add(name)
+        return recomputed
+
+    def value(self, name: str) -> Any:
+        """
+        :param name: a formula or input symbol
+        :return: its current value, recomputing stale formulas first
+        """
+        name = variable_name(name)
+        if name in self._inputs:
+            return self._inputs[name]
+        self.recompute()
+        return self._values[name]
+
+    def values(self) -> Dict[str, Any]:
+        """
+        :return: the current value of every formula
+        """
+        self.recompute()
+        return dict(self._values)
@@ -1,12 +1,26 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+import math
 import re
 
 # Separate these out so can add Greeks etc
 _LETTER = "[a-zA-Z]"
 _ALPHANUM = "[a-zA-Z0-9]"
-_NUMBER = "[0-9]+"
+_NUMBER = r"[0-9]+(?:\.[0-9]+)?"
 _PRFX_BINARY_OPERATORS = r"\\frac"
 _IFX_BINARY_OPERATORS = "\+|-|\*|/|\^"
+# Big operators are lexed with their bounds, e.g. \sum_{i=1}^{n}. Bounds must not nest braces.
+_BIG_OPERATORS = r"\\sum|\\prod"
+_BOUND = r"(\{[^{}]*\}|[a-zA-Z0-9])"
+_BIG_OPERATOR = f"({_BIG_OPERATORS})_{_BOUND}\\^{_BOUND}"
+_ENV_BEGIN = r"\\begin\{[a-zA-Z]+\*?\}"
+_ENV_END = r"\\end\{[a-zA-Z]+\*?\}"
+_ROW_SEPARATOR = r"\\\\"
+_COLUMN_SEPARATOR = "&"
+# Relations compare values, e.g. in the conditions of cases. \le must not match \left.
+_RELATIONS = r"(\\leq?|\\geq?|\\neq)(?![a-zA-Z])|<|>|="
+_TEXT = r"\\text\{[^{}]*\}"
+# Control words that are lexed as functions but stand for constants
+NAMED_CONSTANTS = {r"\pi": math.pi}
 
 # Only supports single subscript depth. Subscripts must be alphanumeric.
 _SUBSCR = f"_{_ALPHANUM}+|_\\{{{_ALPHANUM}+\\}}"
@@ -42,6 +56,12 @@ class Lexer:
             "VAR",
             "BINOP_INFIX",
             "BINOP_PRFIX",
+            "BIGOP",
+            "ENV_BEGIN",
+            "ENV_END",
+            "ROWSEP",
+            "COLSEP",
+            "TEXT",
             "FUNC",
             "LPAREN",
             "RPAREN",
@@ -192,6 +212,80 @@ class Lexer:
                 self.symbol_mapping.update({key: _resolve_binop_name(val)})
         return tokenize_operators
 
+    def _lex_environments(self, in_string: str) -> str:
+        """
+        Tokenizes environment delimiters, row separators and column separators
+
+        :param in_string: the input to be lexed
+        :return: the input with all of them removed
+        """
+
+        def _resolve_environment_name(environment_latex: str) -> str:
+            return environment_latex[environment_latex.index("{") + 1:-1]
+
+        environment_lexers = [
+            self.generate_lexer_pass(_ENV_BEGIN, "ENV_BEGIN"),
+            self.generate_lexer_pass(_ENV_END, "ENV_END"),
+            self.generate_lexer_pass(_ROW_SEPARATOR, "ROWSEP"),
+            self.generate_lexer_pass(_COLUMN_SEPARATOR, "COLSEP"),
+        ]
+        for environment_pass in environment_lexers:
+            in_string = environment_pass(self, in_string)
+        for key, val in self.symbol_mapping.items():
+            if "ENV_" in key:
+                self.symbol_mapping.update({key: _resolve_environment_name(val)})
+        return in_string
+
+    def _lex_text(self, in_string: str) -> str:
+        """
+        :param in_string: the input to be lexed
+        :return: the input with all \\text{...} annotations removed
+        """
+
+        def _resolve_text(text_latex: str) -> str:
+            return text_latex[len("\\text{"):-1].strip()
+
+        text_lexer = self.generate_lexer_pass(_TEXT, "TEXT")
+        tokenize_text = text_lexer(self, in_string)
+        for key, val in self.symbol_mapping.items():
+            if "TEXT" in key:
+                self.symbol_mapping.update({key: _resolve_text(val)})
+        return tokenize_text
+
+    def _lex_relations(self, in_string: str) -> str:
+        """
+        :param in_string: the input to be lexed
+        :return: the input with all relations removed
+        """
+
+        def _resolve_relation_name(relation_latex: str) -> str:
+            relation_mappings = {
+                "\\le": "<=",
+                "\\leq": "<=",
+                "\\ge": ">=",
+                "\\geq": ">=",
+                "\\neq": "!=",
+                "=": "==",
+            }
+            return relation_mappings.get(relation_latex, relation_latex)
+
+        relation_lexer = self.generate_lexer_pass(_RELATIONS, "BINOP_INFIX")
+        lexed_tokens = set(self.symbol_mapping)
+        tokenize_relations = relation_lexer(self, in_string)
+        for key, val in list(self.symbol_mapping.items()):
+            if key not in lexed_tokens:
+                self.symbol_mapping.update({key: _resolve_relation_name(val)})
+        return tokenize_relations
+
+    def _lex_big_operators(self, in_string: str) -> str:
+        """
+        :param in_string: the input to be lexed
+        :return: the input with all big operators and their bounds removed
+        """
+        big_operator_lexer = self.generate_lexer_pass(_BIG_OPERATOR, "BIGOP")
+        tokenize_big_operators = big_operator_lexer(self, in_string)
+        return tokenize_big_operators
+
     def _lex_prefix_binops(self, in_string: str) -> str:
         """
         :param in_string: the input to be lexed
@@ -211,8 +305,15 @@ class Lexer:
 
     def lex(self, in_string: str):
 
+        self.token_index = {}
+        self.symbol_mapping = {}
+        self.symbol_counters = {}
         self.unlexed_indices = list(range(len(in_string)))
         lexer_passes = [
+            self._lex_text,
+            self._lex_environments,
+            self._lex_big_operators,
+            self._lex_relations,
             self._lex_prefix_binops,
             self._lex_functions,
             self._lex_variables,
@@ -225,3 +326,128 @@ class Lexer:
 
         output = self._build_token_list()
         return output
+
+
+# The characters and control sequences that matter when looking for top level sums
+_STRUCTURE = re.compile(r"\\([a-zA-Z]+|.)|[-+{}()\[\]<>=&]", re.DOTALL)
+_SPLIT_OPERATORS = ["+", "-"]
+_OPENING = "{(["
+_CLOSING = "})]"
+
+
+def _subscript_start(in_string: str, idx: int) -> int:
+    # The index of the _ of a subscript ending at idx, as _SUBSCR matches, or -1 if there is none
+    start = idx
+    if in_string[idx] == "}":
+        start = idx - 1
+        while start >= 0 and in_string[start].isalnum():
+            start -= 1
+        if start < 0 or in_string[start] != "{" or start == idx - 1:
+            return -1
+        start -= 1
+    else:
+        while start >= 0 and in_string[start].isalnum():
+            start -= 1
+    if start < 0 or in_string[start] != "_" or start == idx:
+        return -1
+    return start
+
+
+def _ends_operand(in_string: str, idx: int, text_starts: Dict[int, int]) -> bool:
+    # Whether the last non-space character before idx ends an operand, so a sign there is binary.
+    # \text{...} is dropped by the lexer, so whatever comes before it decides.
+    while idx >= 0 and (in_string[idx].isspace() or idx in text_starts):
+        idx = text_starts[idx] - 1 if idx in text_starts else idx - 1
+    if idx < 0:
+        return False
+    if not in_string[idx].isalnum() and in_string[idx] not in _CLOSING:
+        return False
+    # A control word with subscripts is lexed as one function, e.g. \log_{2}
+    end = idx
+    while idx > 0 and _subscript_start(in_string, idx) > 0:
+        idx = _subscript_start(in_string, idx) - 1
+    word_start = idx
+    while word_start >= 0 and in_string[word_start].isalpha():
+        word_start -= 1
+    if word_start >= 0 and in_string[word_start] == "\\" and word_start < idx:
+        # Only constants are operands, other functions make a sign after them unary
+        return in_string[word_start:end + 1] in NAMED_CONSTANTS
+    return True
+
+
+def split_top_level(in_string: str) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    Splits a string at its binary + and - outside all brackets and environments.
+
+    These bind loosest of everything but relations, so the terms parse independently
+    and the rpn of the whole is the rpn of the terms, joined by the operators in order.
+    Products and the arguments of \\frac or functions are not split.
+
+    :param in_string: the input to be split
+    :return: the terms and the operators between them, or None if the string has
+    relations, separators or unbalanced brackets at the top level
+    """
+    terms = []
+    operators = []
+    depth = 0
+    term_start = 0
+    # the end of each \\text{...} -> its start
+    text_starts = {match.end() - 1: match.start() for match in re.finditer(_TEXT, in_string)}
+    for match in _STRUCTURE.finditer(in_string):
+        char = match.group()
+        control = match.group(1)
+        if control is not None:
+            if control == "begin":
+                depth += 1
+            elif control == "end":
+                depth -= 1
+            elif control in ["le", "leq", "ge", "geq", "neq", "\\"] and depth == 0:
+                return None
+            elif control in _OPENING:
+                depth += 1
+            elif control in _CLOSING:
+                depth -= 1
+        elif char in _OPENING:
+            depth += 1
+        elif char in _CLOSING:
+            depth -= 1
+        elif depth == 0 and char in _SPLIT_OPERATORS:
+            if _ends_operand(in_string, match.start() - 1, text_starts):
+                terms.append(in_string[term_start:match.start()])
+                operators.append(char)
+                term_start = match.end()
+        elif depth == 0 and char in "<>=&":
+            return None
+        if depth < 0:
+            return None
+    if depth != 0:
+        return None
+    terms.append(in_string[term_start:])
+    return terms, operators
+
+
+def token_type(token: str) -> str:
+    """
+    Gets the type of a token produced by the lexer
+
+    :param token: a token such as VAR_1 or LPAREN
+    :return: the token type without its counter suffix
+    """
+    if token in ["LPAREN", "RPAREN"]:
+        return token
+    return token.rsplit("_", 1)[0]
+
+
+def lex(in_string: str) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Lexes a string with a lexer local to this call.
+
+    The lexer keeps its working state on the instance, so sharing one between
+    threads corrupts the results. This function is reentrant.
+
+    :param in_string: the input to be lexed
+    :return: the token list and the mapping of tokens to symbols
+    """
+    lexer = Lexer()
+    token_list = lexer.lex(in_string)
+    return token_list, lexer.symbol_mapping
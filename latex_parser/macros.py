@@ -0,0 +1,326 @@
+"""
+Expansion of \\newcommand and \\def macros, ahead of the lexer.
+
+Definitions are read as the text is scanned, so a macro is usable from the point it is defined,
+and removed from the output. Each distinct invocation, a macro and its argument text, is
+expanded once and cached, along with a source map relative to the invocation. Reusing it only
+translates the map to where the invocation and its arguments are in the original text.
+
+Parsing expands macros on request only: parse(..., macros=True), or a LatexParser given a
+MacroExpander, whose definitions persist between calls.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+_CONTROL_WORD = re.compile(r"\\([a-zA-Z]+|.)", re.DOTALL)
+_NEWCOMMANDS = ["newcommand", "renewcommand", "providecommand"]
+_DEF_PARAMETERS = re.compile(r"(?:#[1-9])*")
+# Deeper nesting than this is taken to be runaway recursion
+_MAX_DEPTH = 64
+# Offsets in a cached expansion that point at the invocation rather than an argument
+_INVOCATION = -1
+
+
+class MacroError(Exception):
+    """Raised when a macro definition or invocation is malformed"""
+    pass
+
+
+class MacroRecursionError(MacroError):
+    """Raised when a macro expands, directly or indirectly, to itself"""
+    pass
+
+
+class Macro(NamedTuple):
+    """A macro definition"""
+
+    name: str
+    n_arguments: int
+    body: str
+    # the value of the first argument when it is left out, if it is optional
+    default: Optional[str] = None
+
+
+class Expansion(NamedTuple):
+    """
+    Text with its macros expanded.
+
+    text -- the expanded text
+    offsets -- for each character of the text, the offset in the original text it came from,
+    then the length of the original text. Characters from a macro body map to the start of
+    the invocation.
+    """
+
+    text: str
+    offsets: Tuple[int, ...]
+
+    def token_offsets(self, token_index: Dict[str, int]) -> Dict[str, int]:
+        """
+        :param token_index: token start indices in the expanded text, from Lexer.token_index
+        :return: the token start offsets in the original text
+        """
+        return {token: self.offsets[index] for token, index in token_index.items()}
+
+
+class MacroCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+
+
+class _Scanner:
+    """A position in text whose characters have known offsets"""
+
+    def __init__(self, text: str, offsets: Sequence[int]):
+        self.text = text
+        self.offsets = offsets
+        self.position = 0
+
+    def at_end(self) -> bool:
+        return self.position >= len(self.text)
+
+    def skip_space(self):
+        while not self.at_end() and self.text[self.position].isspace():
+            self.position += 1
+
+    def peek(self) -> str:
+        self.skip_space()
+        return self.text[self.position] if not self.at_end() else ""
+
+    def control_word(self) -> str:
+        match = _CONTROL_WORD.match(self.text, self.position)
+        if match is None:
+            # A backslash that ends the text
+            self.position += 1
+            return ""
+        self.position = match.end()
+        return match.group(1)
+
+    def group(self, open_brace: str = "{", close_brace: str = "}") -> Tuple[str, Sequence[int]]:
+        # The text between balanced braces, without the braces
+        start = self.position + 1
+        depth = 0
+        while not self.at_end():
+            char = self.text[self.position]
+            if char == "\\":
+                self.position += 2
+                continue
+            if char == open_brace:
+                depth += 1
+            elif char == close_brace:
+                depth -= 1
+                if depth == 0:
+                    self.position += 1
+                    return self.text[start:self.position - 1], self.offsets[start:self.position - 1]
+            self.position += 1
+        raise MacroError(f"Unbalanced {open_brace} at offset {self.offsets[start - 1]}!")
+
+    def argument(self) -> Tuple[str, Sequence[int]]:
+        # A braced group, or else a single control word or character
+        char = self.peek()
+        if not char:
+            raise MacroError("Macro is missing an argument!")
+        if char == "{":
+            return self.group()
+        start = self.position
+        if char == "\\":
+            self.control_word()
+        else:
+            self.position += 1
+        return self.text[start:self.position], self.offsets[start:self.position]
+
+
+class MacroExpander:
+    """
+    Expands macros, remembering definitions and expansions between calls.
+    """
+
+    def __init__(self):
+        self.macros: Dict[str, Macro] = {}
+        # (name, argument text) -> expanded text and its offsets relative to the invocation
+        self._expansions: Dict[Tuple[str, Tuple[str, ...]], Tuple[str, List[int]]] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def define(self, name: str, n_arguments: int, body: str, default: Optional[str] = None):
+        """
+        :param name: the macro name, without the backslash
+        :param n_arguments: the number of arguments, #1 to #9 in the body
+        :param body: the text the macro expands to
+        :param default: the value of the first argument when left out, making it optional
+        """
+        if not 0 <= n_arguments <= 9:
+            raise MacroError(f"Macros take 0 to 9 arguments, not {n_arguments}!")
+        if default is not None and n_arguments == 0:
+            raise MacroError(f"Macro {name} has a default but no arguments!")
+        # Cached expansions may have used the old definition, or the name as plain text
+        self._expansions.clear()
+        self.macros[name] = Macro(name, n_arguments, body, default)
+
+    def cache_info(self) -> MacroCacheInfo:
+        return MacroCacheInfo(self._hits, self._misses, len(self._expansions))
+
+    def expand(self, text: str) -> Expansion:
+        """
+        Reads the definitions in the text and expands the macros in it.
+
+        :param text: latex, e.g. a formula or a whole document
+        :return: the expanded text, without the definitions, and its source map
+        """
+        expanded, offsets = self._expand(text, range(len(text)), [])
+        return Expansion(expanded, tuple(offsets) + (len(text),))
+
+    def _expand(
+        self, text: str, offsets: Sequence[int], active: List[str]
+    ) -> Tuple[str, List[int]]:
+        pieces = []
+        piece_offsets = []
+        scanner = _Scanner(text, offsets)
+        copied_from = 0
+        while True:
+            position = text.find("\\", scanner.position)
+            if position < 0:
+                break
+            scanner.position = position
+            name = scanner.control_word()
+            if name in _NEWCOMMANDS or name == "def" or name in self.macros:
+                pieces.append(text[copied_from:position])
+                piece_offsets.extend(offsets[copied_from:position])
+                if name in self.macros:
+                    expanded, expanded_offsets = self._invoke(
+                        self.macros[name], scanner, offsets[position], active
+                    )
+                    pieces.append(expanded)
+                    piece_offsets.extend(expanded_offsets)
+                elif name == "def":
+                    self._read_def(scanner)
+                else:
+                    self._read_newcommand(name, scanner)
+                copied_from = scanner.position
+        pieces.append(text[copied_from:])
+        piece_offsets.extend(offsets[copied_from:])
+        return "".join(pieces), piece_offsets
+
+    def _invoke(
+        self, macro: Macro, scanner: _Scanner, offset: int, active: List[str]
+    ) -> Tuple[str, List[int]]:
+        if macro.name in active:
+            cycle = " -> ".join(active[active.index(macro.name):] + [macro.name])
+            raise MacroRecursionError(f"Macro expands to itself: {cycle}")
+        if len(active) >= _MAX_DEPTH:
+            raise MacroRecursionError(f"Macros nest deeper than {_MAX_DEPTH}: {active[0]}")
+
+        arguments = []
+        for idx in range(macro.n_arguments):
+            if idx == 0 and macro.default is not None:
+                if scanner.peek() == "[":
+                    arguments.append(scanner.group("[", "]"))
+                else:
+                    arguments.append((macro.default, [offset] * len(macro.default)))
+            else:
+                arguments.append(scanner.argument())
+
+        key = (macro.name, tuple(argument for argument, _ in arguments))
+        if key in self._expansions:
+            self._hits += 1
+        else:
+            self._misses += 1
+            self._expansions[key] = self._substitute(macro, key[1], active)
+        expanded, relative_offsets = self._expansions[key]
+
+        argument_offsets = [
+            argument_offset for _, offsets in arguments for argument_offset in offsets
+        ]
+        return expanded, [
+            offset if relative == _INVOCATION else argument_offsets[relative]
+            for relative in relative_offsets
+        ]
+
+    def _substitute(
+        self, macro: Macro, arguments: Sequence[str], active: List[str]
+    ) -> Tuple[str, List[int]]:
+        # Argument characters are numbered through all arguments, and body characters point at
+        # the invocation, so the result can be placed at any invocation with the same arguments.
+        # Arguments are expanded first, as they may use the macro without recursing.
+        start = 0
+        expanded_arguments = []
+        for argument in arguments:
+            expanded_arguments.append(
+                self._expand(argument, range(start, start + len(argument)), active)
+            )
+            start += len(argument)
+        text = []
+        offsets = []
+        body = macro.body
+        idx = 0
+        while idx < len(body):
+            if body[idx] == "#" and idx + 1 < len(body) and body[idx + 1].isdigit():
+                number = int(body[idx + 1])
+                if not 1 <= number <= macro.n_arguments:
+                    raise MacroError(f"Macro {macro.name} has no argument #{number}!")
+                text.append(expanded_arguments[number - 1][0])
+                offsets.extend(expanded_arguments[number - 1][1])
+                idx += 2
+            else:
+                text.append(body[idx])
+                offsets.append(_INVOCATION)
+                idx += 1
+        return self._expand("".join(text), offsets, active + [macro.name])
+
+    def _macro_name(self, scanner: _Scanner) -> str:
+        if scanner.peek() == "{":
+            name, _ = scanner.group()
+            name = name.strip()
+        elif scanner.peek() == "\\":
+            start = scanner.position
+            scanner.control_word()
+            name = scanner.text[start:scanner.position]
+        else:
+            name = ""
+        if not re.fullmatch(r"\\[a-zA-Z]+", name):
+            raise MacroError(f"Expected a macro name, not {name!r}!")
+        return name[1:]
+
+    def _read_newcommand(self, command: str, scanner: _Scanner):
+        # \newcommand{\name}[n][default]{body}, or \newcommand*
+        if scanner.peek() == "*":
+            scanner.position += 1
+        name = self._macro_name(scanner)
+        n_arguments = 0
+        default = None
+        if scanner.peek() == "[":
+            count, _ = scanner.group("[", "]")
+            if not count.strip().isdigit():
+                raise MacroError(f"Macro {name} has a bad argument count {count!r}!")
+            n_arguments = int(count)
+            if scanner.peek() == "[":
+                default, _ = scanner.group("[", "]")
+        if scanner.peek() != "{":
+            raise MacroError(f"Macro {name} has no body!")
+        body, _ = scanner.group()
+        if command == "providecommand" and name in self.macros:
+            return
+        self.define(name, n_arguments, body, default)
+
+    def _read_def(self, scanner: _Scanner):
+        # \def\name#1#2{body}
+        name = self._macro_name(scanner)
+        scanner.skip_space()
+        parameters = _DEF_PARAMETERS.match(scanner.text, scanner.position).group()
+        scanner.position += len(parameters)
+        if parameters != "".join(f"#{idx}" for idx in range(1, len(parameters) // 2 + 1)):
+            raise MacroError(f"Parameters of {name} must be #1, #2, ... in order!")
+        if scanner.peek() != "{":
+            raise MacroError(f"Only undelimited parameters are supported, in {name}!")
+        body, _ = scanner.group()
+        self.define(name, len(parameters) // 2, body)
+
+
+def expand_macros(text: str) -> Expansion:
+    """
+    Expands the macros a text defines, with an expander local to this call.
+
+    :param text: latex with macro definitions
+    :return: the expanded text and its source map
+    """
+    return MacroExpander().expand(text)
@@ -0,0 +1,227 @@
+"""
+Evaluation of one formula over huge arrays on a pool of processes.
+
+The input columns and the output live in multiprocessing.shared_memory segments. Workers
+attach to the segments by name, so a task only carries the formula, the segment names and
+the bounds of its slice, and each worker writes its slice of the result into the shared
+output in place. Nothing is copied back to the parent.
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy
+
+from latex_parser.ast import numpy_dtypes
+from latex_parser.parser import compile_function
+
+# The most array elements a task evaluates at once, bounding the temporaries of each worker
+_CHUNK_SIZE = 1 << 20
+
+# segment name, shape and dtype: everything a worker needs to map an array
+_Layout = Tuple[str, Tuple[int, ...], str]
+
+
+def _attach(layout: _Layout, segments: List[shared_memory.SharedMemory]) -> numpy.ndarray:
+    name, shape, dtype = layout
+    segment = shared_memory.SharedMemory(name=name)
+    segments.append(segment)
+    return numpy.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _evaluate_slice(
+    parse_string: str,
+    dtype: str,
+    columns: Dict[str, _Layout],
+    scalars: Dict[str, Any],
+    output: _Layout,
+    start: int,
+    stop: int,
+):
+    # Runs in a worker. compile_function is cached, so each worker compiles the formula once.
+    function = compile_function(parse_string, dtype)
+    segments = []
+    try:
+        arguments = dict(scalars)
+        for name, layout in columns.items():
+            arguments[name] = _attach(layout, segments)[start:stop]
+        _attach(output, segments)[start:stop] = function(**arguments)
+        del arguments
+    finally:
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # A view is still held by the traceback of an exception being raised
+                pass
+
+
+class SharedMemoryEvaluator:
+    """
+    Evaluates a formula over large arrays, split by index range across worker processes.
+
+    Arrays from allocate() are passed to the workers as they are; other arrays are copied
+    into shared memory once per call. Results are arrays in shared memory owned by the
+    evaluator, and stay valid until it is closed. Use as a context manager:
+
+        with SharedMemoryEvaluator(r"\\sin(x)\\exp(-y)") as evaluator:
+            x = evaluator.allocate(10 ** 9)
+            x[:] = ...
+            result = evaluator.evaluate(x=x, y=0.5)
+    """
+
+    def __init__(self, parse_string: str, dtype: str = "float64", n_workers: Optional[int] = None):
+        if dtype not in numpy_dtypes:
+            raise ValueError(
+                f"Parallel evaluation needs a NumPy dtype, one of {list(numpy_dtypes)}, not {dtype}"
+            )
+        self.parse_string = parse_string
+        self.dtype = dtype
+        self.n_workers = n_workers or os.cpu_count()
+        self._function = compile_function(parse_string, dtype)
+        self._segments: Dict[str, shared_memory.SharedMemory] = {}
+        # segment name -> address it is mapped at in this process, to recognise its arrays
+        self._addresses: Dict[str, int] = {}
+        # unlinked segments waiting for the caller's views of them to go before closing
+        self._released: List[shared_memory.SharedMemory] = []
+        self._executor = ProcessPoolExecutor(max_workers=self.n_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory. Copy results first to keep them.
+        """
+        self._executor.shutdown()
+        for name, segment in list(self._segments.items()):
+            segment.unlink()
+            try:
+                segment.close()
+                del self._segments[name]
+                del self._addresses[name]
+            except BufferError:
+                # Still viewed by a caller's array, which keeps the memory mapped until it goes
+                pass
+        self._close_released()
+
+    def allocate(self, shape, dtype: Optional[str] = None) -> numpy.ndarray:
+        """
+        :param shape: the shape of the array
+        :param dtype: the array dtype, defaults to the evaluator's
+        :return: an array in shared memory, which evaluate() passes to workers without copying
+        """
+        dtype = numpy.dtype(numpy_dtypes.get(dtype or self.dtype, dtype))
+        shape = tuple(numpy.atleast_1d(shape))
+        segment = shared_memory.SharedMemory(
+            create=True, size=max(1, math.prod(shape) * dtype.itemsize)
+        )
+        array = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        self._segments[segment.name] = segment
+        self._addresses[segment.name] = array.ctypes.data
+        return array
+
+    def _layout(self, array: numpy.ndarray) -> Optional[_Layout]:
+        if not array.flags.c_contiguous:
+            return None
+        for name, address in self._addresses.items():
+            if array.ctypes.data == address:
+                return name, array.shape, array.dtype.str
+        return None
+
+    def _shared_copy(self, value: numpy.ndarray) -> _Layout:
+        copy = self.allocate(value.shape, value.dtype.str)
+        copy[...] = value
+        return self._layout(copy)
+
+    def _free(self, name: str):
+        segment = self._segments.pop(name)
+        del self._addresses[name]
+        segment.close()
+        segment.unlink()
+
+    def release(self, array: numpy.ndarray):
+        """
+        Frees the shared memory of an array from allocate() or evaluate().
+        The memory is unmapped once the last view of the array is gone.
+
+        :param array: the array, which must not be used afterwards
+        """
+        name = self._layout(array)[0]
+        segment = self._segments.pop(name)
+        del self._addresses[name], array
+        segment.unlink()
+        self._released.append(segment)
+        self._close_released()
+
+    def _close_released(self):
+        still_viewed = []
+        for segment in self._released:
+            try:
+                segment.close()
+            except BufferError:
+                still_viewed.append(segment)
+        self._released = still_viewed
+
+    def evaluate(self, out: Optional[numpy.ndarray] = None, **values) -> numpy.ndarray:
+        """
+        Evaluates the formula, elementwise along the first axis of the array arguments.
+
+        :param out: an array from allocate() to write the result into, allocated if None
+        :param values: the free variables. Arrays must share their first dimension.
+        :return: the result, in shared memory
+        """
+        arrays = {name: value for name, value in values.items() if numpy.ndim(value)}
+        scalars = {name: value for name, value in values.items() if not numpy.ndim(value)}
+        if not arrays:
+            raise ValueError("Parallel evaluation needs at least one array argument!")
+        lengths = {len(value) for value in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Array arguments must have the same length, not {sorted(lengths)}")
+        length = lengths.pop()
+
+        # The first row gives the shape and dtype of the result, e.g. matrices per row
+        probe = numpy.asarray(
+            self._function(**scalars, **{name: value[:1] for name, value in arrays.items()})
+        )
+        shape = (length,) + probe.shape[1:]
+        if out is None:
+            out = self.allocate(shape, probe.dtype.str)
+        elif self._layout(out) is None or out.shape != shape:
+            raise ValueError(f"out must be an array of shape {shape} from allocate()")
+
+        columns = {}
+        copies = []
+        try:
+            for name, value in arrays.items():
+                columns[name] = self._layout(numpy.asarray(value))
+                if columns[name] is None:
+                    columns[name] = self._shared_copy(numpy.asarray(value))
+                    copies.append(columns[name][0])
+
+            row_size = max(1, math.prod(shape[1:]))
+            chunk_length = max(1, min(_CHUNK_SIZE // row_size, -(-length // self.n_workers)))
+            tasks = [
+                self._executor.submit(
+                    _evaluate_slice,
+                    self.parse_string,
+                    self.dtype,
+                    columns,
+                    scalars,
+                    self._layout(out),
+                    start,
+                    min(start + chunk_length, length),
+                )
+                for start in range(0, length, chunk_length)
+            ]
+            for task in tasks:
+                task.result()
+        finally:
+            for name in copies:
+                self._free(name)
+        return out
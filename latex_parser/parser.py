@@ -1,24 +1,196 @@
-from latex_parser.algorithms import shunting_yard
-from latex_parser.lexer import Lexer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+import ast
+import os
+
+from latex_parser.algorithms import normalise_tokens, shunting_yard
+from latex_parser.ast import FunctionTreeFactory
+from latex_parser.lexer import lex, split_top_level, token_type
+from latex_parser.macros import MacroExpander, expand_macros
 from latex_parser.utilities import rpn_to_ast
 
+_PARSE_CACHE_SIZE = 4096
+# Shorter strings parse faster serially than they can be shipped to worker processes
+_PARALLEL_MIN_LENGTH = 1 << 16
+# Tasks per worker, so uneven terms still balance
+_TASKS_PER_WORKER = 4
+
+# normalised tokens, symbol mapping and rpn, in plain picklable containers
+_Parsed = Tuple[List[str], Dict[str, str], List[str]]
+
+
+class ParseResult(NamedTuple):
+    """
+    The immutable result of parsing a latex string.
+
+    tokens -- the normalised token list
+    symbol_mapping -- a read-only mapping of tokens to symbols
+    rpn -- the tokens in reverse polish notation
+    """
+
+    tokens: Tuple[str, ...]
+    symbol_mapping: Mapping[str, str]
+    rpn: Tuple[str, ...]
+
+    def rpn_string(self) -> str:
+        """
+        :return: the symbols in reverse polish notation, separated by spaces
+        """
+        return " ".join(self.symbol_mapping[token] for token in self.rpn)
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def parse(parse_string: str, macros: bool = False) -> ParseResult:
+    """
+    Parses a latex string into reverse polish notation.
+
+    All working state is local to the call and the result is immutable,
+    so results are cached and this may be called from any number of threads.
+
+    :param parse_string: the latex to be parsed
+    :param macros: expand the \\newcommand and \\def macros the string defines first
+    :return: the parse result
+    """
+    if macros:
+        parse_string = expand_macros(parse_string).text
+    tokens, symbol_mapping, rpn = _parse(parse_string)
+    return ParseResult(tuple(tokens), MappingProxyType(symbol_mapping), tuple(rpn))
+
+
+def _parse(parse_string: str) -> _Parsed:
+    tokens, symbol_mapping = lex(parse_string)
+    tokens, symbol_mapping = normalise_tokens(tokens, symbol_mapping)
+    return tokens, symbol_mapping, shunting_yard(tokens, symbol_mapping)
+
+
+def _parse_terms(terms: List[str]) -> List[_Parsed]:
+    # Runs in a worker, uncached, as the terms of one huge string are rarely seen again
+    return [_parse(term) for term in terms]
+
+
+def _stitch(parsed_terms: Iterable[_Parsed], operators: List[str]) -> ParseResult:
+    # Joins the terms as the serial parse would: tokens are renumbered by position, and as the
+    # operators bind loosest and associate left, each applies to everything before it.
+    tokens = []
+    symbol_mapping = {}
+    rpn = []
+    counters = {}
+
+    def renumber(kind: str, symbol: str) -> str:
+        counters[kind] = counters.get(kind, 0) + 1
+        token = f"{kind}_{counters[kind]}"
+        tokens.append(token)
+        symbol_mapping[token] = symbol
+        return token
+
+    for idx, (term_tokens, term_mapping, term_rpn) in enumerate(parsed_terms):
+        if idx > 0:
+            operator = renumber("BINOP_INFIX", operators[idx - 1])
+        renamed = {}
+        for token in term_tokens:
+            if token in ["LPAREN", "RPAREN"]:
+                tokens.append(token)
+            else:
+                renamed[token] = renumber(token_type(token), term_mapping[token])
+        rpn.extend(renamed[token] for token in term_rpn)
+        if idx > 0:
+            rpn.append(operator)
+    return ParseResult(tuple(tokens), MappingProxyType(symbol_mapping), tuple(rpn))
+
+
+def parse_parallel(
+    parse_string: str,
+    max_workers: Optional[int] = None,
+    min_length: int = _PARALLEL_MIN_LENGTH,
+) -> ParseResult:
+    """
+    Parses one huge latex string on a pool of processes.
+
+    The string is split at its top level + and -, outside all brackets and environments,
+    and the terms are lexed and parsed in the workers. Strings that are short, or that
+    cannot be split, e.g. with a relation at the top level, are parsed serially, as are
+    the terms themselves: a single huge product or \\frac gains nothing.
+
+    :param parse_string: the latex to be parsed
+    :param max_workers: the number of processes, defaults to the number of CPUs
+    :param min_length: the shortest string to parse in parallel
+    :return: the parse result, identical to that of parse
+    """
+    split = split_top_level(parse_string) if len(parse_string) >= min_length else None
+    if split is None or len(split[0]) == 1:
+        return parse(parse_string)
+    terms, operators = split
+
+    max_workers = max_workers or os.cpu_count()
+    n_tasks = min(len(terms), max_workers * _TASKS_PER_WORKER)
+    bounds = [len(terms) * idx // n_tasks for idx in range(n_tasks + 1)]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        parsed_chunks = executor.map(
+            _parse_terms, [terms[start:stop] for start, stop in zip(bounds, bounds[1:])]
+        )
+        return _stitch(
+            (parsed for chunk in parsed_chunks for parsed in chunk), operators
+        )
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def compile_function(parse_string: str, dtype: str = "float64", macros: bool = False) -> Callable:
+    """
+    Compiles a latex string into a function of its free variables.
+
+    :param parse_string: the latex to be compiled
+    :param dtype: the number type to compute in, one of ast.DTYPES
+    :param macros: expand the \\newcommand and \\def macros the string defines first
+    :return: the function, taking the free variables as (keyword) arguments
+    """
+    parse_result = parse(parse_string, macros)
+    return FunctionTreeFactory(dtype=dtype).create_function(
+        parse_result.rpn, parse_result.symbol_mapping
+    )
+
+
+def parse_many(
+    parse_strings: Iterable[str], max_workers: Optional[int] = None
+) -> List[ParseResult]:
+    """
+    Parses a batch of latex strings on a thread pool.
+
+    The speedup needs a free-threaded (no-GIL) build of CPython;
+    with the GIL, this is no faster than parsing in a loop.
+
+    :param parse_strings: the latex strings to be parsed
+    :param max_workers: the number of threads, defaults to the executor's choice
+    :return: the parse results, in the order of the input
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(parse, parse_strings))
+
 
 class LatexParser:
-    def __init__(self):
-        self._parse_str = ""
-        self._rpn_str = ""
-        self._ast = None
-        self._parse_algorithm = shunting_yard
+    """
+    Parses latex strings. Holds no per-call state, so one instance can be
+    shared between threads.
+
+    Given a MacroExpander, macros are expanded before parsing, and definitions
+    persist between calls, e.g. from a preamble. The expander is not thread-safe.
+    """
+
+    def __init__(self, macros: Optional[MacroExpander] = None):
+        self.macros = macros
+
+    def _expand(self, parse_string: str) -> str:
+        if self.macros is None:
+            return parse_string
+        return self.macros.expand(parse_string).text
 
     def parse(self, parse_string: str) -> str:
-        if parse_string != self._parse_str:
-            self._parse_str = parse_string
-            parser_inp = Lexer.tokenize(self._parse_str)
-            parser_out = self._parse_algorithm(parser_inp)
-            self._rpn_str = Lexer.untokenize(parse_string)
-        return self._rpn_str
-
-    def to_ast(self, parse_string):
-        rpn_str = self.parse(parse_string)
-        self._ast = rpn_to_ast(rpn_str)
-        return self._ast
+        return parse(self._expand(parse_string)).rpn_string()
+
+    def to_ast(self, parse_string: str) -> ast.Expression:
+        parse_result = parse(self._expand(parse_string))
+        return rpn_to_ast(parse_result.rpn, parse_result.symbol_mapping)
+
+    def to_function(self, parse_string: str, dtype: str = "float64") -> Callable:
+        return compile_function(self._expand(parse_string), dtype)
@@ -0,0 +1,292 @@
+"""
+Structural search over the math in a LaTeX corpus.
+
+Every subexpression of every formula is hashed with its variables renamed by order of first
+appearance, so \\frac{\\sin(x)}{x} and \\frac{\\sin(t)}{t} hash the same. The hashes are kept
+in an inverted index on disk, and a pattern query is one index lookup with no re-parsing.
+Macros a document defines are expanded before its math is found, and matches report offsets
+in the original source.
+
+Usage:
+    python -m latex_parser.search index corpus.db paper.tex chapters/
+    python -m latex_parser.search query corpus.db "\\frac{\\sin(x)}{x}"
+"""
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from latex_parser.algorithms import ShuntingYardError, UnknownTokenError
+from latex_parser.lexer import token_type
+from latex_parser.macros import Expansion, MacroError, expand_macros
+from latex_parser.parser import parse
+from latex_parser.utilities import operand_count, variable_name
+
+_MATH_REGEX = re.compile(
+    r"\$\$(?P<display>.+?)\$\$"
+    r"|\$(?P<inline>.+?)\$"
+    r"|\\\[(?P<bracket>.+?)\\\]"
+    r"|\\\((?P<paren>.+?)\\\)"
+    r"|\\begin\{(?P<env>equation|align|gather|multline)\*?\}(?P<body>.+?)\\end\{(?P=env)\*?\}",
+    re.DOTALL,
+)
+# Line breaks, alignment and relations separate the formulas in a math block, unless they are
+# inside braces, e.g. the bounds of a sum, or an environment, e.g. the cells of a matrix
+_SEPARATOR_REGEX = re.compile(
+    r"(?P<escaped>\\[{}])"
+    r"|(?P<begin>\\begin\{[^{}]*\})"
+    r"|(?P<end>\\end\{[^{}]*\})"
+    r"|(?P<open>\{)"
+    r"|(?P<close>\})"
+    r"|(?P<separator>\\\\|&|=|<|>|\\(?:leq?|geq?|neq)\b)"
+)
+# Operators that mean the same thing whichever way they were written
+_EQUIVALENT_SYMBOLS = {"prefix_div": "/"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS formulas (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    offset INTEGER NOT NULL,
+    latex TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    hash INTEGER NOT NULL,
+    formula_id INTEGER NOT NULL REFERENCES formulas(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS occurrences_by_hash ON occurrences(hash);
+CREATE INDEX IF NOT EXISTS formulas_by_document ON formulas(document_id);
+"""
+
+
+class Match(NamedTuple):
+    """A formula containing a pattern"""
+
+    path: str
+    offset: int
+    latex: str
+
+
+def extract_math(document: str) -> List[Tuple[int, str]]:
+    """
+    Finds the math in a LaTeX document.
+
+    :param document: the LaTeX source
+    :return: the offset and source of each formula
+    """
+    formulas = []
+    for match in _MATH_REGEX.finditer(document):
+        group = next(
+            name for name in ["display", "inline", "bracket", "paren", "body"]
+            if match.group(name) is not None
+        )
+        start = match.start(group)
+        line_start = 0
+        depth = 0
+        for separator in _SEPARATOR_REGEX.finditer(match.group(group)):
+            if separator.lastgroup in ["begin", "open"]:
+                depth += 1
+            elif separator.lastgroup in ["end", "close"]:
+                depth -= 1
+            elif separator.lastgroup == "separator" and depth == 0:
+                formulas.append(
+                    (start + line_start, match.group(group)[line_start:separator.start()])
+                )
+                line_start = separator.end()
+        formulas.append((start + line_start, match.group(group)[line_start:]))
+    return [(offset, latex) for offset, latex in formulas if latex.strip()]
+
+
+def _subtree_starts(rpn: Sequence[str], symbol_mapping: Dict[str, str]) -> List[int]:
+    starts = []
+    operand_starts = []
+    for idx, token in enumerate(rpn):
+        arity = operand_count(token_type(token), symbol_mapping[token])
+        if len(operand_starts) < arity:
+            raise ValueError(f"Operator {token} is missing an operand!")
+        start = idx
+        for _ in range(arity):
+            start = operand_starts.pop()
+        operand_starts.append(start)
+        starts.append(start)
+    return starts
+
+
+def structural_hashes(rpn: Sequence[str], symbol_mapping: Dict[str, str]) -> List[int]:
+    """
+    Hashes every subexpression, with its variables renamed by order of first appearance.
+
+    :param rpn: the tokens in reverse polish notation
+    :param symbol_mapping: the mapping of tokens to symbols
+    :return: the signed 64 bit hash of the subtree rooted at each token, in rpn order
+    """
+    symbols = []
+    for token in rpn:
+        kind = token_type(token)
+        symbol = symbol_mapping[token]
+        if kind == "VAR":
+            symbols.append((kind, variable_name(symbol)))
+        else:
+            symbols.append((kind, _EQUIVALENT_SYMBOLS.get(symbol, symbol)))
+
+    hashes = []
+    for idx, start in enumerate(_subtree_starts(rpn, symbol_mapping)):
+        renaming = {}
+        canonical = []
+        for kind, symbol in symbols[start:idx + 1]:
+            if kind == "VAR":
+                symbol = str(renaming.setdefault(symbol, len(renaming)))
+            canonical.append(f"{kind[0]}:{symbol}")
+        digest = hashlib.blake2b(" ".join(canonical).encode("utf-8"), digest_size=8).digest()
+        hashes.append(int.from_bytes(digest, "little", signed=True))
+    return hashes
+
+
+def _formula_hashes(latex: str) -> List[int]:
+    parse_result = parse(latex)
+    hashes = structural_hashes(parse_result.rpn, parse_result.symbol_mapping)
+    # Single variables and literals would match nearly every formula
+    return sorted({
+        subtree_hash
+        for token, subtree_hash in zip(parse_result.rpn, hashes)
+        if token_type(token) not in ["CONS", "VAR"]
+    })
+
+
+class FormulaIndex:
+    """
+    An inverted index from structural subtree hashes to formulas, stored in SQLite.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def add_document(self, path: str, document: str, mtime: float = 0.0) -> int:
+        """
+        Indexes the math in a document, replacing anything indexed for the path before.
+
+        :param path: the name the document is found under
+        :param document: the LaTeX source
+        :param mtime: the modification time of the source
+        :return: the number of formulas indexed. Formulas that fail to parse are skipped.
+        """
+        try:
+            expansion = expand_macros(document)
+        except MacroError:
+            expansion = Expansion(document, tuple(range(len(document) + 1)))
+        n_formulas = 0
+        with self._connection:
+            self._connection.execute("DELETE FROM documents WHERE path = ?", (path,))
+            document_id = self._connection.execute(
+                "INSERT INTO documents (path, mtime) VALUES (?, ?)", (path, mtime)
+            ).lastrowid
+            for offset, latex in extract_math(expansion.text):
+                offset = expansion.offsets[offset]
+                try:
+                    hashes = _formula_hashes(latex)
+                except (ShuntingYardError, UnknownTokenError, ValueError, KeyError):
+                    continue
+                formula_id = self._connection.execute(
+                    "INSERT INTO formulas (document_id, offset, latex) VALUES (?, ?, ?)",
+                    (document_id, offset, latex),
+                ).lastrowid
+                self._connection.executemany(
+                    "INSERT INTO occurrences (hash, formula_id) VALUES (?, ?)",
+                    [(subtree_hash, formula_id) for subtree_hash in hashes],
+                )
+                n_formulas += 1
+        return n_formulas
+
+    def add_paths(self, paths: Iterable[str]) -> int:
+        """
+        Indexes .tex files, descending into directories. Unchanged files are not re-read.
+
+        :param paths: files and directories
+        :return: the number of files (re)indexed
+        """
+        n_files = 0
+        for file_path in _tex_files(paths):
+            mtime = os.path.getmtime(file_path)
+            row = self._connection.execute(
+                "SELECT mtime FROM documents WHERE path = ?", (file_path,)
+            ).fetchone()
+            if row is not None and row[0] == mtime:
+                continue
+            with open(file_path, encoding="utf-8", errors="replace") as tex_file:
+                self.add_document(file_path, tex_file.read(), mtime)
+            n_files += 1
+        return n_files
+
+    def search(self, pattern: str) -> List[Match]:
+        """
+        Finds every formula containing the pattern, whatever its variables are named.
+
+        :param pattern: the latex of the subexpression to search for
+        :return: the matching formulas, in document order
+        """
+        parse_result = parse(pattern)
+        if len(parse_result.rpn) < 2:
+            raise ValueError("Patterns must contain an operator or function!")
+        pattern_hash = structural_hashes(parse_result.rpn, parse_result.symbol_mapping)[-1]
+        rows = self._connection.execute(
+            "SELECT DISTINCT documents.path, formulas.offset, formulas.latex"
+            " FROM occurrences"
+            " JOIN formulas ON formulas.id = occurrences.formula_id"
+            " JOIN documents ON documents.id = formulas.document_id"
+            " WHERE occurrences.hash = ?"
+            " ORDER BY documents.path, formulas.offset",
+            (pattern_hash,),
+        )
+        return [Match(*row) for row in rows]
+
+
+def _tex_files(paths: Iterable[str]) -> Iterable[str]:
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, _, file_names in os.walk(path):
+            for file_name in sorted(file_names):
+                if file_name.endswith(".tex"):
+                    yield os.path.join(directory, file_name)
+
+
+def main(argv: Sequence[str] = None):
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = argument_parser.add_subparsers(dest="command", required=True)
+    index_command = commands.add_parser("index", help="index .tex files")
+    index_command.add_argument("database")
+    index_command.add_argument("paths", nargs="+")
+    query_command = commands.add_parser("query", help="find formulas containing a pattern")
+    query_command.add_argument("database")
+    query_command.add_argument("pattern")
+    arguments = argument_parser.parse_args(argv)
+
+    with FormulaIndex(arguments.database) as index:
+        if arguments.command == "index":
+            print(f"Indexed {index.add_paths(arguments.paths)} files")
+        else:
+            for match in index.search(arguments.pattern):
+                print(f"{match.path}:{match.offset}: {match.latex.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Compact binary serialization of token lists, rpn and expression trees.
+
+A packed expression is one buffer, laid out as (all little-endian, 4-byte aligned):
+
+    header        -- magic, version, kind, record and symbol counts
+    offsets       -- uint32[n_symbols + 1], offsets of each symbol in the blob
+    blob          -- the interned symbols, utf-8 encoded
+    opcodes       -- uint8[n_records], the token type of each record
+    arities       -- uint32[n_records], the number of operands of each record
+    symbol ids    -- uint32[n_records], index into the symbol table, or NO_SYMBOL
+    first child   -- uint32[n_records], see below
+    numbers       -- uint32[n_records], the counter suffix of each token, 0 for parentheses
+
+Trees are stored in post-order, which is the rpn order. The first child of a node is also
+the first node of its subtree, and leaves point at themselves, so the children of node i are
+found by walking back from i - 1. Token lists store their own index there.
+
+PackedExpression reads the records through memoryviews of the buffer, so loading
+does no per-node work and a buffer from a file or shared memory is not copied.
+"""
+import ast
+import struct
+import sys
+from array import array
+from typing import Dict, List, Sequence, Tuple, Union
+
+from latex_parser.lexer import token_type
+from latex_parser.utilities import operand_count, rpn_to_ast
+
+MAGIC = b"LXPB"
+VERSION = 2
+NO_SYMBOL = 0xFFFFFFFF
+
+KIND_TOKENS = 0
+KIND_RPN = 1
+
+_HEADER = struct.Struct("<4sBBHIII")
+
+OPCODES = {
+    "CONS": 1,
+    "VAR": 2,
+    "BINOP_INFIX": 3,
+    "BINOP_PRFIX": 4,
+    "FUNC": 5,
+    "LPAREN": 6,
+    "RPAREN": 7,
+    "BIGOP": 8,
+    "MATRIX": 9,
+    "ENV_BEGIN": 10,
+    "ENV_END": 11,
+    "ROWSEP": 12,
+    "COLSEP": 13,
+    "TEXT": 14,
+    "CASES": 15,
+}
+TOKEN_TYPES = {opcode: kind for kind, opcode in OPCODES.items()}
+
+_AST_OPERATORS = {
+    ast.Add: ("BINOP_INFIX", "+"),
+    ast.Sub: ("BINOP_INFIX", "-"),
+    ast.Mult: ("BINOP_INFIX", "*"),
+    ast.Div: ("BINOP_INFIX", "/"),
+    ast.Pow: ("BINOP_INFIX", "expt"),
+    ast.MatMult: ("BINOP_INFIX", "*"),
+    ast.USub: ("FUNC", "neg"),
+    ast.Lt: ("BINOP_INFIX", "<"),
+    ast.Gt: ("BINOP_INFIX", ">"),
+    ast.LtE: ("BINOP_INFIX", "<="),
+    ast.GtE: ("BINOP_INFIX", ">="),
+    ast.Eq: ("BINOP_INFIX", "=="),
+    ast.NotEq: ("BINOP_INFIX", "!="),
+}
+_BIG_OPERATOR_FUNCTIONS = {"sum_reduce": "sum", "prod_reduce": "prod"}
+
+
+class SerializationError(Exception):
+    """Raised when a buffer does not hold a packed expression"""
+    pass
+
+
+def _padding(length: int) -> int:
+    return -length % 4
+
+
+def _pack(kind: int, typed_symbols: Sequence[Tuple[str, str, int]]) -> bytes:
+    symbol_ids = {}
+    opcodes = array("B")
+    arities = array("I")
+    symbols = array("I")
+    first_children = array("I")
+    numbers = array("I")
+    for idx, (kind_name, symbol, number) in enumerate(typed_symbols):
+        numbers.append(number)
+        opcodes.append(OPCODES[kind_name])
+        arity = operand_count(kind_name, symbol)
+        arities.append(arity)
+        if symbol is None:
+            symbols.append(NO_SYMBOL)
+        else:
+            symbols.append(symbol_ids.setdefault(symbol, len(symbol_ids)))
+        if kind == KIND_RPN and arity:
+            # Walk back over the operands to the start of the first one
+            child = idx - 1
+            for _ in range(arity - 1):
+                child = first_children[child] - 1
+            first_children.append(first_children[child])
+        else:
+            first_children.append(idx)
+
+    encoded = [symbol.encode("utf-8") for symbol in symbol_ids]
+    offsets = array("I", [0])
+    for symbol in encoded:
+        offsets.append(offsets[-1] + len(symbol))
+    blob = b"".join(encoded)
+
+    if sys.byteorder != "little":
+        for values in [arities, symbols, first_children, numbers, offsets]:
+            values.byteswap()
+
+    n_records = len(opcodes)
+    header = _HEADER.pack(MAGIC, VERSION, kind, 0, n_records, len(encoded), len(blob))
+    return b"".join(
+        [
+            header,
+            offsets.tobytes(),
+            blob,
+            bytes(_padding(len(blob))),
+            opcodes.tobytes(),
+            bytes(_padding(n_records)),
+            arities.tobytes(),
+            symbols.tobytes(),
+            first_children.tobytes(),
+            numbers.tobytes(),
+        ]
+    )
+
+
+def _typed_symbol(token: str, symbol_mapping: Dict[str, str]) -> Tuple[str, str, int]:
+    kind = token_type(token)
+    if kind == token:
+        return kind, None, 0
+    return kind, symbol_mapping[token], int(token[len(kind) + 1:])
+
+
+def pack_tokens(tokens: Sequence[str], symbol_mapping: Dict[str, str]) -> bytes:
+    """
+    :param tokens: a token list, from the lexer or normalise_tokens
+    :param symbol_mapping: the mapping of tokens to symbols
+    :return: the packed token list. Parentheses are stored without their symbols.
+    """
+    return _pack(KIND_TOKENS, [_typed_symbol(token, symbol_mapping) for token in tokens])
+
+
+def pack_rpn(rpn: Sequence[str], symbol_mapping: Dict[str, str]) -> bytes:
+    """
+    :param rpn: the tokens in reverse polish notation, from shunting_yard
+    :param symbol_mapping: the mapping of tokens to symbols
+    :return: the packed rpn, which is also the packed tree
+    """
+    return _pack(KIND_RPN, [_typed_symbol(token, symbol_mapping) for token in rpn])
+
+
+def pack_tree(expression: ast.Expression) -> bytes:
+    """
+    :param expression: an expression tree, as built by rpn_to_ast
+    :return: the packed tree
+    """
+    typed_symbols = []
+    counters = {}
+
+    def _append(kind: str, symbol: str):
+        counters[kind] = counters.get(kind, 0) + 1
+        typed_symbols.append((kind, symbol, counters[kind]))
+
+    pending = [(expression.body, False)]
+    while pending:
+        node, visited = pending.pop()
+        if isinstance(node, ast.Constant):
+            _append("CONS", repr(node.value))
+        elif isinstance(node, ast.Name):
+            _append("VAR", node.id)
+        elif visited:
+            if isinstance(node, ast.Call) and node.func.id in _BIG_OPERATOR_FUNCTIONS:
+                _append("BIGOP", _BIG_OPERATOR_FUNCTIONS[node.func.id])
+            elif isinstance(node, ast.Call) and node.func.id == "matrix":
+                rows = node.args[0].elts
+                _append("MATRIX", f"{len(rows)}x{len(rows[0].elts)}")
+            elif isinstance(node, ast.Call) and node.func.id == "matrix_power":
+                _append("BINOP_INFIX", "expt")
+            elif isinstance(node, ast.Call) and node.func.id == "piecewise":
+                _append("CASES", f"cases{len(node.args[0].elts)}")
+            elif isinstance(node, ast.Call):
+                _append("FUNC", node.func.id)
+            elif isinstance(node, ast.Compare):
+                _append(*_AST_OPERATORS[type(node.ops[0])])
+            elif isinstance(node.op, ast.BitAnd):
+                _append(*_AST_OPERATORS[type(node.right.ops[0])])
+            else:
+                _append(*_AST_OPERATORS[type(node.op)])
+        elif isinstance(node, ast.Call) and node.func.id == "matrix_operand":
+            # Broadcasting is implied by the operands of the parent, so is not packed
+            pending.append((node.args[0], False))
+        else:
+            pending.append((node, True))
+            if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+                # a < b < c is (a < b) & (b < c), which packs as a b < c <
+                operands = [node.left, node.right.comparators[0]]
+            elif isinstance(node, ast.BinOp):
+                operands = [node.left, node.right]
+            elif isinstance(node, ast.Compare):
+                operands = [node.left, node.comparators[0]]
+            elif isinstance(node, ast.UnaryOp):
+                operands = [node.operand]
+            elif isinstance(node, ast.Call) and node.func.id in _BIG_OPERATOR_FUNCTIONS:
+                # sum_reduce(lambda i: body, lower, upper, *context) packs as i lower upper body
+                function, lower, upper = node.args[:3]
+                index = ast.Name(id=function.args.args[0].arg, ctx=ast.Load())
+                operands = [index, lower, upper, function.body]
+            elif isinstance(node, ast.Call) and node.func.id == "matrix":
+                operands = [cell for row in node.args[0].elts for cell in row.elts]
+            elif isinstance(node, ast.Call) and node.func.id == "piecewise":
+                # piecewise([(lambda: condition, lambda: value), ...]) packs as value condition ...
+                operands = []
+                for condition, value in (branch.elts for branch in node.args[0].elts):
+                    operands.extend([value.body, condition.body])
+            elif isinstance(node, ast.Call):
+                operands = node.args
+            else:
+                raise SerializationError(f"Cannot pack {type(node).__name__} nodes!")
+            pending.extend((operand, False) for operand in reversed(operands))
+    return _pack(KIND_RPN, typed_symbols)
+
+
+class PackedExpression:
+    """
+    A read-only view of a packed expression, backed by the buffer it was loaded from.
+    """
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview]):
+        view = memoryview(buffer).cast("B")
+        if len(view) < _HEADER.size:
+            raise SerializationError("Buffer is too short for a header!")
+        magic, version, kind, _, n_records, n_symbols, blob_size = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise SerializationError("Buffer does not hold a packed expression!")
+
+        offset = _HEADER.size
+        sections = []
+        for size in [
+            4 * (n_symbols + 1),
+            blob_size + _padding(blob_size),
+            n_records + _padding(n_records),
+            4 * n_records,
+            4 * n_records,
+            4 * n_records,
+            4 * n_records,
+        ]:
+            sections.append(view[offset:offset + size])
+            offset += size
+        if offset > len(view):
+            raise SerializationError("Buffer is truncated!")
+        offsets, blob, opcodes, arities, symbols, first_children, numbers = sections
+
+        self.kind = kind
+        self._blob = blob
+        self.opcodes = opcodes[:n_records]
+        self.arities = self._uint32(arities)
+        self._offsets = self._uint32(offsets)
+        self.symbol_ids = self._uint32(symbols)
+        self.first_children = self._uint32(first_children)
+        self.numbers = self._uint32(numbers)
+
+    @staticmethod
+    def _uint32(view: memoryview):
+        if sys.byteorder == "little":
+            return view.cast("I")
+        values = array("I", view.tobytes())
+        values.byteswap()
+        return values
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    @property
+    def n_symbols(self) -> int:
+        return len(self._offsets) - 1
+
+    def symbol(self, symbol_id: int) -> str:
+        """
+        :param symbol_id: an index into the symbol table
+        :return: the symbol
+        """
+        start, end = self._offsets[symbol_id], self._offsets[symbol_id + 1]
+        return str(self._blob[start:end], "utf-8")
+
+    def token_type(self, idx: int) -> str:
+        return TOKEN_TYPES[self.opcodes[idx]]
+
+    def children(self, idx: int) -> List[int]:
+        """
+        :param idx: the index of a node in a packed tree
+        :return: the indices of its children, in order
+        """
+        children = []
+        child = idx - 1
+        for _ in range(self.arities[idx]):
+            children.append(child)
+            child = self.first_children[child] - 1
+        return children[::-1]
+
+    def tokens(self) -> Tuple[List[str], Dict[str, str]]:
+        """
+        :return: the token list and the mapping of tokens to symbols
+        """
+        symbols = [self.symbol(symbol_id) for symbol_id in range(self.n_symbols)]
+        tokens = []
+        symbol_mapping = {}
+        for opcode, symbol_id, number in zip(self.opcodes, self.symbol_ids, self.numbers):
+            kind = TOKEN_TYPES[opcode]
+            if symbol_id == NO_SYMBOL:
+                tokens.append(kind)
+                continue
+            token = f"{kind}_{number}"
+            tokens.append(token)
+            symbol_mapping[token] = symbols[symbol_id]
+        return tokens, symbol_mapping
+
+    def to_ast(self) -> ast.Expression:
+        """
+        :return: the expression tree of a packed rpn or tree
+        """
+        if self.kind != KIND_RPN:
+            raise SerializationError("Only packed rpn can be built into a tree!")
+        return rpn_to_ast(*self.tokens())
@@ -0,0 +1,94 @@
+"""
+Evaluation of one formula over rows that arrive over time, e.g. a time series feed.
+
+Only new rows are evaluated, so the cost of a batch depends on its size and not on the
+history before it. The formula is parsed and compiled once, and each batch is passed to the
+compiled function as it is, without copying.
+"""
+from typing import Any, AsyncIterable, AsyncIterator, Mapping
+
+import numpy
+
+from latex_parser.ast import free_variables, numpy_dtypes
+from latex_parser.parser import compile_function, parse
+
+
+class StreamingEvaluator:
+    """
+    Evaluates a formula over appended rows, returning the results of the new rows only.
+
+        evaluator = StreamingEvaluator(r"\\frac{x - m}{s}", m=0.5, s=2.0)
+        evaluator.append(x=1.0)               # one row: array([0.25])
+        evaluator.append(x=[1.0, 2.0, 3.0])   # a chunk: array([0.25, 0.75, 1.25])
+
+    Variables given as constants are fixed for the life of the evaluator; the others are
+    columns, given for every batch.
+    """
+
+    def __init__(self, parse_string: str, dtype: str = "float64", **constants):
+        if dtype not in numpy_dtypes:
+            raise ValueError(
+                f"Streaming evaluation needs a NumPy dtype, one of {list(numpy_dtypes)}, not {dtype}"
+            )
+        parse_result = parse(parse_string)
+        variables = free_variables(parse_result.rpn, parse_result.symbol_mapping)
+        unknown = set(constants) - set(variables)
+        if unknown:
+            raise ValueError(f"Constants {sorted(unknown)} are not variables of {parse_string}")
+
+        self.parse_string = parse_string
+        self.dtype = dtype
+        self.constants = constants
+        self.columns = tuple(name for name in variables if name not in constants)
+        # the number of rows evaluated so far
+        self.n_rows = 0
+        self._function = compile_function(parse_string, dtype)
+
+    def append(self, **values) -> numpy.ndarray:
+        """
+        Evaluates the formula for a batch of new rows.
+
+        :param values: each column, as a 1-D sequence for a chunk of rows, or a scalar for
+        one row or a value shared by the whole chunk. Sequences have the same length.
+        :return: the results of the new rows, along the first axis
+        """
+        missing = set(self.columns) - set(values)
+        extra = set(values) - set(self.columns)
+        if missing or extra:
+            raise ValueError(
+                f"Expected the columns {list(self.columns)}, got {sorted(values)}"
+            )
+        lengths = {len(value) for value in values.values() if numpy.ndim(value)}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns must have the same number of rows, not {sorted(lengths)}")
+        is_chunk = bool(lengths)
+        n_rows = lengths.pop() if is_chunk else 1
+
+        for name, value in values.items():
+            if numpy.ndim(value) > 1:
+                raise ValueError(f"Column {name} must be a scalar or 1-D, not {numpy.ndim(value)}-D")
+
+        result = numpy.asarray(self._function(**self.constants, **values))
+        if not is_chunk:
+            # One row, given as scalars
+            result = result[numpy.newaxis]
+        elif any(numpy.shares_memory(result, value) for value in values.values()):
+            # e.g. the formula x, whose result would be the caller's array itself
+            result = result.copy()
+        self.n_rows += n_rows
+        return result
+
+    async def stream(
+        self, batches: AsyncIterable[Mapping[str, Any]]
+    ) -> AsyncIterator[numpy.ndarray]:
+        """
+        Evaluates batches as they arrive:
+
+            async for results in evaluator.stream(feed):
+                ...
+
+        :param batches: the columns of each batch, as accepted by append
+        :return: the results of each batch, in order
+        """
+        async for batch in batches:
+            yield self.append(**batch)
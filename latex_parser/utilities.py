@@ -1,15 +1,40 @@
 import ast
+from typing import Dict, Sequence, Set, Tuple
+
+from latex_parser.lexer import NAMED_CONSTANTS, token_type
+
+_BINARY_OPERATORS = {
+    "+": ast.Add,
+    "-": ast.Sub,
+    "*": ast.Mult,
+    "/": ast.Div,
+    "expt": ast.Pow,
+    "prefix_div": ast.Div,
+}
+_UNARY_OPERATORS = {"neg": ast.USub}
+_RELATIONS = {
+    "<": ast.Lt,
+    ">": ast.Gt,
+    "<=": ast.LtE,
+    ">=": ast.GtE,
+    "==": ast.Eq,
+    "!=": ast.NotEq,
+}
+# The number of operands of each operator token type, see operand_count for matrices and cases.
+# Big operators take their index variable, lower bound, upper bound and body.
+ARITIES = {"BINOP_INFIX": 2, "BINOP_PRFIX": 2, "BIGOP": 4, "FUNC": 1}
+
 
 def isUnary(operator: str) -> bool:
-    raise NotImplementedError("isUnary not implemented!")
+    return token_type(operator) == "FUNC"
 
 
 def isBinary(operator: str) -> bool:
-    raise NotImplementedError("isBinary not implemented!")
+    return token_type(operator) in ["BINOP_INFIX", "BINOP_PRFIX"]
 
 
 def isOperator(operator: str) -> bool:
-    raise NotImplementedError("isOperator not implemented!")
+    return isUnary(operator) or isBinary(operator)
 
 
 def idx_of_first_operator(rpn_str: str) -> int:
@@ -21,38 +46,240 @@ def idx_of_second_operator(rpn_str: str) -> int:
     return idx_of_first_operator(rpn_substr)
 
 
-def rpn_to_ast(rpn_str: str) -> ast.AST:
-    rpn_list = rpn_str.split(" ")
-    idx_operator = len(rpn_list)-1
-    operator = rpn_list[idx_operator]
+def literal_value(symbol: str):
+    """
+    Gets the Python number a literal symbol stands for.
+
+    :param symbol: the symbol of a CONS token, e.g. 3, 0.5 or \\pi
+    :return: the value of the literal
+    """
+    if symbol in NAMED_CONSTANTS:
+        return NAMED_CONSTANTS[symbol]
+    if symbol.isdigit():
+        return int(symbol)
+    return float(symbol)
+
+
+def variable_name(symbol: str) -> str:
+    """
+    Gets the Python identifier for a variable symbol, so x_{1} and x_1 are the same.
+
+    :param symbol: the symbol of a VAR token
+    :return: the symbol as a Python identifier
+    """
+    return symbol.replace("{", "").replace("}", "")
+
+
+def function_name(symbol: str) -> str:
+    """
+    Gets the Python identifier for a function symbol.
+
+    :param symbol: the symbol of a FUNC token
+    :return: the symbol as a Python identifier
+    """
+    return symbol.lstrip("\\")
+
+
+def matrix_shape(symbol: str) -> Tuple[int, int]:
+    """
+    :param symbol: the symbol of a MATRIX token, e.g. 2x3
+    :return: the number of rows and columns
+    """
+    n_rows, n_columns = symbol.split("x")
+    return int(n_rows), int(n_columns)
+
+
+def matrix_size(symbol: str) -> int:
+    """
+    :param symbol: the symbol of a MATRIX token
+    :return: the number of cells
+    """
+    n_rows, n_columns = matrix_shape(symbol)
+    return n_rows * n_columns
+
 
-    if isUnary(operator):
-        idx_op_1 = idx_of_first_operator(rpn_str)
+def operand_count(kind: str, symbol: str) -> int:
+    """
+    :param kind: a token type
+    :param symbol: the symbol of the token
+    :return: the number of operands the token takes in reverse polish notation
+    """
+    if kind == "MATRIX":
+        return matrix_size(symbol)
+    if kind == "CASES":
+        return 2 * int(symbol[len("cases"):])
+    return ARITIES.get(kind, 0)
 
-        if idx_op_1 == len(rpn_str) - 1:
-            # construct the unary sub-AST directly here and return
-            raise NotImplementedError("[!] Construct unary AST not implemented!")
 
-        rpn_substr_unary = " ".join()
-        # construt the unary AST from its sub ASTs
-        raise NotImplementedError("[!] Construct inner unary AST not implemented!")
+def free_names(node: ast.AST) -> Tuple[str, ...]:
+    """
+    Gets the names an expression tree reads that are not bound inside it.
+    Function names and the index variables of big operators are not free.
 
-    elif isBinary(operator):
-        idx_op_1 = idx_of_first_operator(rpn_str)
+    :param node: the root of the tree
+    :return: the free names, in order of first appearance
+    """
+    names = {}
 
-        if idx_op_1 == len(rpn_str) - 1:
-            # construct the binary sub-AST directly here and return
-            raise NotImplementedError("[!] Construct binary AST not implemented!")
-        idx_op_2 = idx_of_second_operator(rpn_str)
+    def _visit(node: ast.AST, bound: Set[str]):
+        if isinstance(node, ast.Name):
+            if node.id not in bound:
+                names.setdefault(node.id)
+        elif isinstance(node, ast.Lambda):
+            _visit(node.body, bound | {argument.arg for argument in node.args.args})
+        elif isinstance(node, ast.Call):
+            for argument in node.args:
+                _visit(argument, bound)
+        else:
+            for child in ast.iter_child_nodes(node):
+                _visit(child, bound)
 
-        rpn_substr_l = " ".join(rpn_list[:idx_op_1])
-        rpn_substr_r = " ".join(rpn_list[idx_op_1:idx_op_2])
+    _visit(node, set())
+    return tuple(names)
 
-        l_ast = rpn_to_ast(rpn_substr_l)
-        r_ast = rpn_to_ast(rpn_substr_r)
 
-        # construct the binary AST from its sub ASTs
-        raise NotImplementedError("[!] Construct inner binary AST not implemented!")
+def _lambda(names: Sequence[str], body: ast.AST) -> ast.Lambda:
+    arguments = ast.arguments(
+        posonlyargs=[],
+        args=[ast.arg(arg=name) for name in names],
+        kwonlyargs=[],
+        kw_defaults=[],
+        defaults=[],
+    )
+    return ast.Lambda(args=arguments, body=body)
 
+
+def _big_operator_ast(
+    symbol: str, index: ast.AST, lower: ast.AST, upper: ast.AST, body: ast.AST
+) -> ast.Call:
+    # \sum_{i=a}^{b} body is sum_reduce(lambda i: body, a, b, *free names of the body)
+    if not isinstance(index, ast.Name):
+        raise ValueError(f"Big operator {symbol} must have a variable as its index!")
+    # x_{i} is a variable of its own, not x indexed by i, so would be constant over the terms
+    for name in free_names(body):
+        if index.id in name.split("_")[1:]:
+            raise ValueError(
+                f"Variables indexed by the index {index.id} of {symbol}, such as {name}, "
+                "are not supported!"
+            )
+    function = _lambda([index.id], body)
+    context = [ast.Name(id=name, ctx=ast.Load()) for name in free_names(function)]
+    return ast.Call(
+        func=ast.Name(id=f"{symbol}_reduce", ctx=ast.Load()),
+        args=[function, lower, upper] + context,
+        keywords=[],
+    )
+
+
+def _relation_ast(symbol: str, left: ast.AST, right: ast.AST) -> ast.AST:
+    # a < b < c is (a < b) & (b < c), which also works elementwise on arrays
+    if isinstance(left, ast.BinOp) and isinstance(left.op, ast.BitAnd):
+        previous = left.right.comparators[-1]
+    elif isinstance(left, ast.Compare):
+        previous = left.comparators[-1]
     else:
-        raise NotImplementedError("[!] Operator {} not recognised!", operator)
+        return ast.Compare(left=left, ops=[_RELATIONS[symbol]()], comparators=[right])
+    comparison = ast.Compare(left=previous, ops=[_RELATIONS[symbol]()], comparators=[right])
+    return ast.BinOp(left=left, op=ast.BitAnd(), right=comparison)
+
+
+def _cases_ast(operands: Sequence[ast.AST]) -> ast.Call:
+    # Cases are piecewise([(lambda *context: condition, lambda *context: value), ...], *context)
+    # so that each condition and value can be evaluated on only the elements it applies to
+    context = free_names(ast.List(elts=list(operands), ctx=ast.Load()))
+    branches = [
+        ast.Tuple(elts=[_lambda(context, condition), _lambda(context, value)], ctx=ast.Load())
+        for value, condition in zip(operands[::2], operands[1::2])
+    ]
+    return _call(
+        "piecewise",
+        [ast.List(elts=branches, ctx=ast.Load())]
+        + [ast.Name(id=name, ctx=ast.Load()) for name in context],
+    )
+
+
+def _call(function: str, arguments: Sequence[ast.AST]) -> ast.Call:
+    return ast.Call(
+        func=ast.Name(id=function, ctx=ast.Load()), args=list(arguments), keywords=[]
+    )
+
+
+def _matrix_binary_ast(symbol: str, left: ast.AST, right: ast.AST, matrices: Tuple[bool, bool]):
+    # Products of matrices are matrix products, and scalars broadcast over matrix entries
+    if symbol == "*" and all(matrices):
+        return ast.BinOp(left=left, op=ast.MatMult(), right=right)
+    if symbol == "expt":
+        if matrices != (True, False):
+            raise ValueError("Only matrices can be raised to powers, and only by scalars!")
+        return _call("matrix_power", [left, right])
+    if not matrices[0]:
+        left = _call("matrix_operand", [left])
+    if not matrices[1]:
+        right = _call("matrix_operand", [right])
+    return ast.BinOp(left=left, op=_BINARY_OPERATORS[symbol](), right=right)
+
+
+def rpn_to_ast(rpn: Sequence[str], symbol_mapping: Dict[str, str]) -> ast.Expression:
+    """
+    Builds a Python expression tree from tokens in reverse polish notation.
+
+    :param rpn: the tokens in reverse polish notation
+    :param symbol_mapping: the mapping of tokens to symbols
+    :return: the expression, with its location information filled in
+    """
+    operand_stack = []
+    # Whether each operand on the stack is a matrix
+    matrix_stack = []
+    for token in rpn:
+        symbol = symbol_mapping[token]
+        kind = token_type(token)
+        n_operands = operand_count(kind, symbol)
+        if len(operand_stack) < n_operands:
+            raise ValueError(f"Operator {symbol} is missing an operand!")
+        operands = operand_stack[len(operand_stack) - n_operands:]
+        matrices = tuple(matrix_stack[len(matrix_stack) - n_operands:])
+        del operand_stack[len(operand_stack) - n_operands:]
+        del matrix_stack[len(matrix_stack) - n_operands:]
+        is_matrix = any(matrices)
+
+        if kind == "CONS":
+            node = ast.Constant(value=literal_value(symbol))
+        elif kind == "VAR":
+            node = ast.Name(id=variable_name(symbol), ctx=ast.Load())
+        elif kind == "MATRIX":
+            n_rows, n_columns = matrix_shape(symbol)
+            rows = [
+                ast.List(elts=operands[row * n_columns:(row + 1) * n_columns], ctx=ast.Load())
+                for row in range(n_rows)
+            ]
+            node = _call("matrix", [ast.List(elts=rows, ctx=ast.Load())])
+            is_matrix = True
+        elif kind == "BIGOP":
+            node = _big_operator_ast(symbol, *operands)
+        elif kind == "CASES":
+            if is_matrix:
+                raise ValueError("Cases must have scalar values and conditions!")
+            node = _cases_ast(operands)
+        elif symbol in _RELATIONS:
+            if is_matrix:
+                raise ValueError("Matrices cannot be compared!")
+            node = _relation_ast(symbol, *operands)
+        elif isBinary(token) and is_matrix:
+            node = _matrix_binary_ast(symbol, *operands, matrices)
+        elif isBinary(token):
+            node = ast.BinOp(left=operands[0], op=_BINARY_OPERATORS[symbol](), right=operands[1])
+        elif isUnary(token):
+            if symbol in _UNARY_OPERATORS:
+                node = ast.UnaryOp(op=_UNARY_OPERATORS[symbol](), operand=operands[0])
+            else:
+                node = _call(function_name(symbol), operands)
+        else:
+            raise NotImplementedError(f"[!] Operator {token} not recognised!")
+        operand_stack.append(node)
+        matrix_stack.append(is_matrix)
+
+    if len(operand_stack) != 1:
+        raise ValueError(
+            f"Expression reduced to {len(operand_stack)} operands, expected 1!"
+        )
+    return ast.fix_missing_locations(ast.Expression(body=operand_stack[0]))
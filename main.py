@@ -1,15 +1,16 @@
 
 import sys
+from ast import dump as ast_dump
 
-from parser import LatexParser
+from latex_parser.parser import LatexParser
 
 
 def main(parse_str: str):
     latex_parser = LatexParser()
     parsed_str = latex_parser.parse(parse_str)
     ast = latex_parser.to_ast(parse_str)
-    print("RPN: {}", parsed_str)
-    print("AST: {}", ast)
+    print("RPN: {}".format(parsed_str))
+    print("AST: {}".format(ast_dump(ast)))
 
 
 if __name__ == '__main__':
@@ -1,5 +1,7 @@
 import unittest
 
+from latex_parser.algorithms import MismatchedParenthesesError
+from latex_parser.algorithms import normalise_tokens
 from latex_parser.algorithms import shunting_yard
 from latex_parser.parser import LatexParser
 from latex_parser.utilities import idx_of_first_operator
@@ -66,3 +68,35 @@ class TestParser(unittest.TestCase):
         inp = r"$(3*sin(\pi^2)+1)/2$"
         out = r"3 \pi 2 ^ sin *"
         self.assertEqual(self.parser(inp), out)
+
+
+class TestTokenShuntingYard(unittest.TestCase):
+    """
+    Tests the shunting yard algorithm on lexer tokens.
+    """
+
+    def test_transforms_tokens(self):
+        tokens = ["CONS_1", "BINOP_INFIX_1", "CONS_2", "BINOP_INFIX_2", "CONS_3"]
+        mapping = {"CONS_1": "1", "BINOP_INFIX_1": "+", "CONS_2": "2",
+                   "BINOP_INFIX_2": "*", "CONS_3": "3"}
+        self.assertEqual(
+            shunting_yard(tokens, mapping),
+            ["CONS_1", "CONS_2", "CONS_3", "BINOP_INFIX_2", "BINOP_INFIX_1"],
+        )
+
+    def test_mismatched_parentheses(self):
+        with self.assertRaises(MismatchedParenthesesError):
+            shunting_yard(["LPAREN", "CONS_1"], {"CONS_1": "1"})
+        with self.assertRaises(MismatchedParenthesesError):
+            shunting_yard(["CONS_1", "RPAREN"], {"CONS_1": "1"})
+
+    def test_normalise_tokens(self):
+        tokens = ["BINOP_INFIX_1", "CONS_1", "VAR_1"]
+        mapping = {"BINOP_INFIX_1": "-", "CONS_1": "2", "VAR_1": "x"}
+        self.assertEqual(
+            normalise_tokens(tokens, mapping),
+            (
+                ["FUNC_1", "CONS_1", "BINOP_INFIX_1", "VAR_1"],
+                {"FUNC_1": "neg", "CONS_1": "2", "BINOP_INFIX_1": "*", "VAR_1": "x"},
+            ),
+        )
@@ -0,0 +1,90 @@
+""" Arena tree tests."""
+import math
+import unittest
+
+from latex_parser.arena import ExpressionArena, NodeView
+from latex_parser.parser import compile_function, parse
+from latex_parser.serialization import PackedExpression, pack_rpn
+
+
+class TestExpressionArena(unittest.TestCase):
+    """
+    Test that trees in an arena have the structure and values of the parsed formulas.
+    """
+
+    def setUp(self):
+        self.formulas = [
+            r"\sin(x)\exp(-y) + \frac{1}{2}",
+            r"x^{2} - 3x + \pi",
+            r"\sum_{i=1}^{n} i^{2}",
+            r"\begin{cases} x & x > 0 \\ -x & \text{otherwise} \end{cases}",
+        ]
+        self.arena = ExpressionArena()
+        self.trees = [self.arena.add_string(formula) for formula in self.formulas]
+
+    def test_layout(self):
+        self.assertEqual(self.trees, [0, 1, 2, 3])
+        self.assertEqual(len(self.arena), 4)
+        self.assertEqual(self.arena.nbytes, 13 * self.arena.n_nodes + 4 * 4)
+        # Symbols are interned across trees
+        self.assertEqual(len(self.arena.symbols), len(set(self.arena.symbols)))
+
+    def test_node_views(self):
+        root = self.arena.root(1)
+        self.assertEqual((root.token_type, root.symbol, root.arity), ("BINOP_INFIX", "+", 2))
+        minus, pi = root.children
+        self.assertEqual(pi.symbol, r"\pi")
+        self.assertEqual([child.symbol for child in minus.children], ["expt", "*"])
+        self.assertEqual(root, NodeView(self.arena, root.index))
+        with self.assertRaises(AttributeError):
+            root.extra = 1
+
+    def test_post_order_is_rpn(self):
+        for tree, formula in zip(self.trees, self.formulas):
+            parse_result = parse(formula)
+            self.assertEqual(
+                [node.symbol for node in self.arena.post_order(tree)],
+                [parse_result.symbol_mapping[token] for token in parse_result.rpn],
+            )
+
+    def test_evaluate(self):
+        self.assertAlmostEqual(
+            self.arena.evaluate(0, x=1.0, y=2.0), math.sin(1.0) * math.exp(-2.0) + 0.5
+        )
+        self.assertAlmostEqual(self.arena.evaluate(1, dtype="float", x=2.0), -2 + math.pi)
+        self.assertEqual(self.arena.evaluate(2, n=3), 14)
+        self.assertEqual(self.arena.evaluate(3, x=-2.0), 2.0)
+        self.assertEqual(
+            self.arena.evaluate(1, dtype="fraction", x=3),
+            compile_function(self.formulas[1], "fraction")(x=3),
+        )
+
+    def test_structural_hash(self):
+        other = ExpressionArena()
+        other.add_string("y")
+        tree = other.add_string(self.formulas[0])
+        self.assertEqual(other.structural_hash(tree), self.arena.structural_hash(0))
+        self.assertNotEqual(self.arena.structural_hash(0), self.arena.structural_hash(1))
+
+    def test_serialization(self):
+        for tree in self.trees:
+            packed = PackedExpression(self.arena.pack(tree))
+            copy = ExpressionArena().add_packed(packed)
+            self.assertEqual(copy, 0)
+        parse_result = parse(self.formulas[0])
+        tree = self.arena.add_packed(
+            PackedExpression(pack_rpn(parse_result.rpn, parse_result.symbol_mapping))
+        )
+        self.assertEqual(self.arena.structural_hash(tree), self.arena.structural_hash(0))
+        self.assertEqual(
+            list(PackedExpression(self.arena.pack(0)).first_children),
+            list(self.arena.first_children[:self.arena.roots[0] + 1]),
+        )
+
+    def test_malformed_rpn(self):
+        n_nodes = self.arena.n_nodes
+        with self.assertRaises(ValueError):
+            self.arena.add(["VAR_1", "BINOP_INFIX_1"], {"VAR_1": "x", "BINOP_INFIX_1": "+"})
+        with self.assertRaises(ValueError):
+            self.arena.add(["VAR_1", "VAR_2"], {"VAR_1": "x", "VAR_2": "y"})
+        self.assertEqual(self.arena.n_nodes, n_nodes)
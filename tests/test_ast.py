@@ -0,0 +1,195 @@
+""" Function tree tests."""
+import math
+import unittest
+import warnings
+from decimal import Decimal
+from fractions import Fraction
+
+import numpy
+
+from latex_parser.ast import FunctionTreeFactory, free_variables, function_tables
+from latex_parser.parser import compile_function, parse
+
+
+class TestDtypes(unittest.TestCase):
+    """
+    Test that functions compute in the dtype they were compiled for.
+    """
+
+    def test_float64_default(self):
+        function = compile_function(r"\frac{1}{3}x + 0.5")
+        result = function(x=numpy.arange(3))
+        self.assertEqual(result.dtype, numpy.float64)
+        numpy.testing.assert_allclose(result, [0.5, 0.5 + 1 / 3, 0.5 + 2 / 3])
+
+    def test_float32(self):
+        function = compile_function(r"\sin(x)^{2} + 2.5x", "float32")
+        result = function(numpy.linspace(0, 1, 5))
+        self.assertEqual(result.dtype, numpy.float32)
+        self.assertEqual(type(function(1.0)), numpy.float32)
+
+    def test_complex128(self):
+        function = compile_function(r"\sqrt{x}", "complex128")
+        self.assertEqual(function(-4), 2j)
+        self.assertEqual(function(numpy.array([-1.0, 4.0])).tolist(), [1j, 2])
+
+    def test_fraction(self):
+        function = compile_function(r"\frac{1}{3} + 0.1x^{2}", "fraction")
+        self.assertEqual(function(x=3), Fraction(1, 3) + Fraction(9, 10))
+        with self.assertRaises(ValueError):
+            compile_function(r"\sin(x)", "fraction")
+
+    def test_decimal(self):
+        function = compile_function(r"\sqrt{x} + 0.1", "decimal")
+        self.assertEqual(function("2.25"), Decimal("1.6"))
+
+    def test_python_float(self):
+        function = compile_function(r"\sin(x) + \frac{x}{4}", "float")
+        result = function(numpy.float32(2))
+        self.assertIs(type(result), float)
+        self.assertEqual(result, math.sin(2) + 0.5)
+
+    def test_unknown_dtype(self):
+        with self.assertRaises(ValueError):
+            FunctionTreeFactory(dtype="int8")
+
+    def test_literals_coerced_once(self):
+        result = parse(r"2x + 2.5")
+        function = FunctionTreeFactory(dtype="float32").create_function(
+            result.rpn, result.symbol_mapping
+        )
+        literals = {
+            name: value for name, value in function.__globals__.items()
+            if name.startswith("_literal_")
+        }
+        self.assertEqual(len(literals), 2)
+        for value in literals.values():
+            self.assertEqual(type(value), numpy.float32)
+
+
+class TestBigOperators(unittest.TestCase):
+    """
+    Test that sums and products reduce over their index.
+    """
+
+    def test_sum(self):
+        function = compile_function(r"\sum_{i=1}^{n} i^{2}x + 1")
+        self.assertEqual(function(n=10, x=1), 386)
+        numpy.testing.assert_array_equal(function(n=10, x=numpy.array([1, 2])), [386, 771])
+        self.assertEqual(function(n=0, x=1), 1)
+
+    def test_nested(self):
+        function = compile_function(r"\sum_{i=1}^{3} \prod_{j=1}^{i} j")
+        self.assertEqual(function(), 1 + 2 + 6)
+
+    def test_chunked(self):
+        function = compile_function(r"\sum_{k=1}^{N} \frac{1}{k^{2}}")
+        self.assertAlmostEqual(function(N=3000000), numpy.pi ** 2 / 6, places=6)
+
+    def test_exact(self):
+        function = compile_function(r"\sum_{i=1}^{n} \frac{1}{i}", "fraction")
+        self.assertEqual(function(n=3), Fraction(11, 6))
+
+    def test_bounds_must_be_integers(self):
+        with self.assertRaises(ValueError):
+            compile_function(r"\sum_{i=1}^{n} i")(n=2.5)
+
+    def test_index_is_not_free(self):
+        result = parse(r"\sum_{i=1}^{n} i x_{k}")
+        self.assertEqual(free_variables(result.rpn, result.symbol_mapping), ("x_k", "n"))
+
+    def test_indexed_variables_are_rejected(self):
+        for parse_string in [r"\sum_{i=1}^{n} x_{i}", r"\prod_{j=1}^{n} \sum_{i=1}^{j} a_{j}"]:
+            with self.assertRaises(ValueError):
+                compile_function(parse_string)
+
+
+class TestMatrices(unittest.TestCase):
+    """
+    Test that matrices evaluate to arrays, with batched products.
+    """
+
+    def setUp(self):
+        self.rotation = r"\begin{pmatrix} \cos(t) & -\sin(t) \\ \sin(t) & \cos(t) \end{pmatrix}"
+
+    def test_matrix_vector_product(self):
+        function = compile_function(
+            r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}\begin{pmatrix} x \\ y \end{pmatrix}"
+        )
+        numpy.testing.assert_array_equal(
+            function(a=1, b=2, c=3, d=4, x=1, y=2), [[5], [11]]
+        )
+
+    def test_batched_product(self):
+        angles = numpy.linspace(0, numpy.pi, 1000)
+        function = compile_function(self.rotation + self.rotation)
+        result = function(t=angles)
+        self.assertEqual(result.shape, (1000, 2, 2))
+        numpy.testing.assert_allclose(result[:, 0, 0], numpy.cos(2 * angles), atol=1e-12)
+        numpy.testing.assert_allclose(result[:, 1, 0], numpy.sin(2 * angles), atol=1e-12)
+
+    def test_scalars_and_powers(self):
+        function = compile_function(
+            r"\frac{\begin{bmatrix} 1 & t \\ 0 & 1 \end{bmatrix}^{3}}{2} + s"
+        )
+        result = function(t=numpy.array([1.0, 2.0]), s=numpy.array([0.0, 1.0]))
+        numpy.testing.assert_array_equal(result[0], [[0.5, 1.5], [0, 0.5]])
+        numpy.testing.assert_array_equal(result[1], [[1.5, 4], [1, 1.5]])
+        with self.assertRaises(ValueError):
+            compile_function(r"2^{\begin{bmatrix} 1 \end{bmatrix}}")
+
+    def test_exact_matrix(self):
+        function = compile_function(
+            r"\begin{pmatrix} \frac{1}{3} & 1 \end{pmatrix}\begin{pmatrix} 3 \\ x \end{pmatrix}",
+            "fraction",
+        )
+        self.assertEqual(function(x=Fraction(1, 2))[0, 0], Fraction(3, 2))
+
+
+class TestCases(unittest.TestCase):
+    """
+    Test that cases evaluate each branch only on the elements it takes.
+    """
+
+    def setUp(self):
+        self.cases = (
+            r"\begin{cases} \ln(x) & x > 0 \\ 0 & x = 0 \\ \sqrt{-x} & \text{otherwise} \end{cases}"
+        )
+
+    def test_no_domain_warnings(self):
+        x = numpy.array([-4.0, 0.0, numpy.e, 1.0])
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            result = compile_function(self.cases)(x=x)
+        numpy.testing.assert_array_equal(result, [2, 0, 1, 0])
+        self.assertEqual(compile_function(self.cases)(x=-9.0), 3)
+        self.assertEqual(compile_function(self.cases, "decimal")(x=-9), Decimal(3))
+
+    def test_branches_see_their_elements(self):
+        sizes = []
+
+        def spy(x):
+            sizes.append(numpy.size(x))
+            return x
+
+        parse_result = parse(
+            r"\begin{cases} \spy(x) & \spy(x) < 1 \\ \spy(x)y & \text{otherwise} \end{cases}"
+        )
+        function = FunctionTreeFactory(
+            function_table=dict(function_tables["float64"], spy=spy)
+        ).create_function(parse_result.rpn, parse_result.symbol_mapping)
+        result = function(x=numpy.arange(10.0), y=2.0)
+        numpy.testing.assert_array_equal(result, [0] + [2 * x for x in range(1, 10)])
+        self.assertEqual(sizes, [10, 1, 9])
+
+    def test_uncovered_elements(self):
+        function = compile_function(r"\begin{cases} 1 & 0 < x < 1 \end{cases} + y")
+        numpy.testing.assert_array_equal(function(x=numpy.array([0.5, 2.0]), y=1.0), [2, numpy.nan])
+        with self.assertRaises(ValueError):
+            compile_function(r"\begin{cases} 1 & x > 0 \end{cases}", "fraction")(x=-1)
+
+    def test_inside_sum(self):
+        function = compile_function(
+            r"\sum_{i=1}^{n} \begin{cases} i & i \le 2 \\ 10 & \text{otherwise} \end{cases}"
+        )
+        numpy.testing.assert_array_equal(function(n=numpy.array([1, 2, 5])), [1, 3, 33])
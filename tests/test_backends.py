@@ -0,0 +1,100 @@
+""" Backend selection tests."""
+import json
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+
+from latex_parser import backends
+from latex_parser.backends import AutoFunction, Calibration, FormulaFeatures, formula_features
+
+# Roughly the unit costs of a laptop
+_CALIBRATION = Calibration(
+    tree_node=1e-6,
+    python_node=5e-8,
+    math_transcendental=5e-8,
+    numpy_call=5e-7,
+    numpy_node=1e-9,
+    numpy_transcendental=1e-8,
+    compile_node=4e-5,
+    copy_element=5e-10,
+    n_cpus=64,
+)
+
+
+class TestCostModel(unittest.TestCase):
+    """
+    Test that the cost model picks the backend suited to the input size.
+    """
+
+    def setUp(self):
+        self.formula = r"\sin(x)\exp(-y) + \frac{x}{3}"
+        self.function = AutoFunction(self.formula, calibration=_CALIBRATION)
+        self.addCleanup(self.function.close)
+
+    def test_features(self):
+        self.assertEqual(formula_features(self.formula), FormulaFeatures(10, 2, 5))
+        self.assertEqual(formula_features("x"), FormulaFeatures(1, 0, 1))
+
+    def test_choices(self):
+        self.assertEqual(self.function.choose(x=0.5, y=1.0).backend, "tree")
+        self.function(x=0.5, y=1.0)
+        self.assertEqual(self.function.last_choice.backend, "tree")
+
+        self.function._function("python")
+        self.assertEqual(self.function.choose(x=0.5, y=1.0).backend, "python")
+        self.assertEqual(self.function.choose(x=numpy.ones(1000), y=1.0).backend, "numpy")
+        choice = self.function.choose(x=numpy.ones(10 ** 8), y=numpy.ones(10 ** 8))
+        self.assertEqual(choice.backend, "parallel")
+        self.assertEqual(choice.n_elements, 10 ** 8)
+        self.assertEqual(set(choice.estimates), set(backends.BACKENDS))
+        # Workers only split one dimensional arrays of the same length
+        choice = self.function.choose(x=numpy.ones((10 ** 4, 10 ** 4)), y=1.0)
+        self.assertEqual(choice.backend, "numpy")
+
+    def test_big_operators_use_numpy(self):
+        function = AutoFunction(r"\sum_{k=1}^{N} \frac{1}{k^{2}}", calibration=_CALIBRATION)
+        self.assertEqual(function.features.n_big_operators, 1)
+        choice = function.choose(N=10 ** 6)
+        self.assertEqual(choice.backend, "numpy")
+        self.assertEqual(set(choice.estimates), {"numpy"})
+        self.assertAlmostEqual(function(N=10 ** 6), math.pi ** 2 / 6, places=5)
+
+    def test_backends_agree(self):
+        x = numpy.linspace(-1, 1, 7)
+        expected = numpy.sin(x) * numpy.exp(-0.5) + x / 3
+        for backend in ["tree", "python", "numpy"]:
+            choice = backends.BackendChoice(backend, 7, self.function.features, {})
+            with mock.patch.object(self.function, "choose", return_value=choice):
+                numpy.testing.assert_allclose(self.function(x=x, y=0.5), expected)
+                self.assertAlmostEqual(self.function(x=x[0], y=0.5), expected[0])
+
+    def test_domain_errors_match_numpy(self):
+        function = AutoFunction(r"\frac{1}{x} + \sqrt{x}", calibration=_CALIBRATION)
+        with numpy.errstate(all="ignore"):
+            self.assertTrue(numpy.isnan(function(x=-1.0)))
+            self.assertEqual(function(x=0.0), numpy.inf)
+
+
+class TestCalibration(unittest.TestCase):
+    """
+    Test that calibrations are measured once and saved.
+    """
+
+    def test_saved_and_loaded(self):
+        with tempfile.TemporaryDirectory() as cache, mock.patch.dict(
+            os.environ, {"XDG_CACHE_HOME": cache}
+        ), mock.patch.object(backends, "_calibration", None):
+            calibration = backends.calibrate()
+            for name, cost in calibration._asdict().items():
+                self.assertTrue(0 < cost < math.inf, name)
+            with open(os.path.join(cache, "latex_parser", "calibration.json")) as saved:
+                self.assertEqual(json.load(saved)["costs"], calibration._asdict())
+
+            backends._calibration = None
+            with mock.patch.object(backends, "_measure") as measure:
+                self.assertEqual(backends.calibrate(), calibration)
+                measure.assert_not_called()
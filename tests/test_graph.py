@@ -0,0 +1,64 @@
+""" Formula graph tests."""
+import unittest
+
+from latex_parser.graph import FormulaCycleError, FormulaGraph
+
+
+class TestFormulaGraph(unittest.TestCase):
+    """
+    Test that formula graphs recompute only what changed.
+    """
+
+    def setUp(self):
+        self.graph = FormulaGraph()
+        self.graph.set_formula("y", r"x^{2}")
+        self.graph.set_formula("z", r"y+1")
+        self.graph.set_formula("w", r"2v")
+        self.graph.set_inputs(x=3, v=5)
+
+    def test_evaluates_dependencies(self):
+        self.assertEqual(self.graph.values(), {"y": 9, "z": 10, "w": 10})
+        self.assertEqual(self.graph.value("x"), 3)
+
+    def test_topological_order(self):
+        order = self.graph.topological_order()
+        self.assertLess(order.index("y"), order.index("z"))
+        self.assertEqual(sorted(order), ["w", "y", "z"])
+
+    def test_recomputes_downstream_only(self):
+        self.graph.recompute()
+        self.assertEqual(self.graph.downstream("x"), {"y", "z"})
+        self.graph.set_inputs(x=4)
+        self.assertEqual(self.graph.recompute(), {"y", "z"})
+        self.assertEqual(self.graph.value("z"), 17)
+        self.assertEqual(self.graph.recompute(), set())
+
+        self.graph.set_formula("y", r"x_{1}x")
+        self.graph.set_inputs(x_1=2)
+        self.assertEqual(self.graph.recompute(), {"y", "z"})
+        self.assertEqual(self.graph.value("z"), 9)
+
+    def test_unbound_symbol(self):
+        self.graph.set_formula("u", r"t+1")
+        with self.assertRaises(NameError):
+            self.graph.recompute()
+
+    def test_cycle(self):
+        self.graph.set_formula("x_1", r"z")
+        self.graph.set_formula("a", r"b")
+        self.graph.set_formula("b", r"a")
+        with self.assertRaises(FormulaCycleError):
+            self.graph.topological_order()
+        self.graph.remove_formula("b")
+        self.graph.set_inputs(b=1)
+        self.assertEqual(self.graph.value("a"), 1)
+
+    def test_names_conflict(self):
+        with self.assertRaises(ValueError):
+            self.graph.set_formula("x", r"1")
+        with self.assertRaises(ValueError):
+            self.graph.set_inputs(y=1)
+        with self.assertRaisesRegex(ValueError, "u is not a formula"):
+            self.graph.remove_formula("u")
+        with self.assertRaisesRegex(ValueError, "x is not a formula"):
+            self.graph.remove_formula("x")
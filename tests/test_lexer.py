@@ -4,7 +4,7 @@ import re
 import unittest
 from typing import List, Dict
 
-from latex_parser.lexer import Lexer  # import Lexer
+from latex_parser.lexer import Lexer, lex, split_top_level
 
 
 def _insert_spaces(string: str, max_run: int) -> str:
@@ -82,6 +82,31 @@ class TestLexerUtilities(unittest.TestCase):
         self.assertEqual(built_list, token_list)
 
 
+class TestSplitTopLevel(unittest.TestCase):
+    """
+    Test that strings split at binary + and - outside brackets only.
+    """
+
+    def test_splits_binary_signs(self):
+        terms, operators = split_top_level(r"-a + \frac{1+b}{2} - \pi - 3 \cdot -x")
+        self.assertEqual(terms, ["-a ", r" \frac{1+b}{2} ", r" \pi ", r" 3 \cdot -x"])
+        self.assertEqual(operators, ["+", "-", "-"])
+
+    def test_keeps_unary_signs_after_functions(self):
+        terms, operators = split_top_level(r"\sin - x + \begin{pmatrix} 1 & -2 \end{pmatrix}")
+        self.assertEqual(terms, [r"\sin - x ", r" \begin{pmatrix} 1 & -2 \end{pmatrix}"])
+        self.assertEqual(operators, ["+"])
+
+    def test_text_is_not_an_operand(self):
+        terms, operators = split_top_level(r"\text{a} - x + y")
+        self.assertEqual(terms, [r"\text{a} - x ", " y"])
+        self.assertEqual(operators, ["+"])
+
+    def test_unsplittable(self):
+        for in_string in ["x + 1 < 2", r"x \le 1 + y", "(a + b", "a + b)"]:
+            self.assertIsNone(split_top_level(in_string), in_string)
+
+
 class TestLexerPasses(unittest.TestCase):
     """
     Test that the various stages of the lexer work correctly.
@@ -375,3 +400,76 @@ class TestLexer(unittest.TestCase):
             "VAR_2": "x",
         }
         self._test_lexing(in_string, output, mapping)
+
+    def test_lexer_is_reusable(self):
+        """
+        Test that lexing twice with one lexer gives the same result.
+        """
+        in_string = r"\sin(x) + 2"
+        first_output = self.lexer.lex(in_string)
+        first_mapping = dict(self.lexer.symbol_mapping)
+        self.assertEqual(self.lexer.lex(in_string), first_output)
+        self.assertEqual(self.lexer.symbol_mapping, first_mapping)
+        self.assertEqual(lex(in_string), (first_output, first_mapping))
+
+    def test_lex_decimal_literal(self):
+        """
+        Test that the lexer keeps decimal literals whole.
+        """
+        self._test_lexing(r"0.25x", ["CONS_1", "VAR_1"], {"CONS_1": "0.25", "VAR_1": "x"})
+
+    def test_lex_big_operator(self):
+        """
+        Test that the lexer keeps big operators together with their bounds.
+        """
+        in_string = r"\sum_{i=1}^{n} x_{i}"
+        output = ["BIGOP_1", "VAR_1"]
+        mapping = {"BIGOP_1": r"\sum_{i=1}^{n}", "VAR_1": "x_{i}"}
+        self._test_lexing(in_string, output, mapping)
+
+    def test_lex_environment(self):
+        """
+        Test that the lexer finds environments and their separators.
+        """
+        in_string = r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}"
+        output = [
+            "ENV_BEGIN_1",
+            "VAR_1",
+            "COLSEP_1",
+            "VAR_2",
+            "ROWSEP_1",
+            "VAR_3",
+            "COLSEP_2",
+            "VAR_4",
+            "ENV_END_1",
+        ]
+        mapping = {
+            "ENV_BEGIN_1": "pmatrix",
+            "VAR_1": "a",
+            "COLSEP_1": "&",
+            "VAR_2": "b",
+            "ROWSEP_1": "\\\\",
+            "VAR_3": "c",
+            "COLSEP_2": "&",
+            "VAR_4": "d",
+            "ENV_END_1": "pmatrix",
+        }
+        self._test_lexing(in_string, output, mapping)
+
+    def test_lex_relations_and_text(self):
+        """
+        Test that the lexer finds relations, without mistaking \\left for \\le.
+        """
+        in_string = r"\text{if } x \le y \neq 1 \left("
+        output = ["TEXT_1", "VAR_1", "BINOP_INFIX_1", "VAR_2", "BINOP_INFIX_2", "CONS_1", "FUNC_1", "LPAREN"]
+        mapping = {
+            "TEXT_1": "if",
+            "VAR_1": "x",
+            "BINOP_INFIX_1": "<=",
+            "VAR_2": "y",
+            "BINOP_INFIX_2": "!=",
+            "CONS_1": "1",
+            "FUNC_1": r"\left",
+            "LPAREN_1": "(",
+        }
+        self._test_lexing(in_string, output, mapping)
@@ -0,0 +1,110 @@
+""" Macro expansion tests."""
+import unittest
+
+from latex_parser.lexer import Lexer
+from latex_parser.macros import MacroError, MacroExpander, MacroRecursionError, expand_macros
+from latex_parser.parser import LatexParser, compile_function, parse
+
+
+class TestMacroExpansion(unittest.TestCase):
+    """
+    Test that macros expand like LaTeX would expand them.
+    """
+
+    def _test_expansion(self, in_string, output):
+        self.assertEqual(expand_macros(in_string).text, output)
+
+    def test_newcommand(self):
+        self._test_expansion(r"\newcommand{\dd}[1]{\frac{d}{d#1}}\dd{t}x", r"\frac{d}{dt}x")
+        self._test_expansion(r"\newcommand*\two{2}\two x", r"2 x")
+        self._test_expansion(r"\newcommand{\dd}[1]{\frac{d}{d#1}}\dd t", r"\frac{d}{dt}")
+
+    def test_def(self):
+        self._test_expansion(r"\def\pair#1#2{(#1, #2)}\pair{a}{\frac{1}{2}}", r"(a, \frac{1}{2})")
+        with self.assertRaises(MacroError):
+            expand_macros(r"\def\pair#2#1{#1}")
+
+    def test_optional_argument(self):
+        in_string = r"\newcommand{\half}[1][x]{\frac{#1}{2}}\half+\half[y]"
+        self._test_expansion(in_string, r"\frac{x}{2}+\frac{y}{2}")
+
+    def test_nested(self):
+        in_string = r"\def\sq#1{#1^{2}}\def\norm#1{\sqrt{\sq{#1}}}\norm{\sq{x}}"
+        self._test_expansion(in_string, r"\sqrt{x^{2}^{2}}")
+
+    def test_redefinition(self):
+        in_string = r"\def\a{1}\def\b{\a}\b\def\a{2}\b\providecommand{\a}{3}\a\renewcommand{\a}{4}\a"
+        self._test_expansion(in_string, "1224")
+
+    def test_definition_after_use(self):
+        in_string = r"\newcommand{\a}{\b+1} \a \newcommand{\b}{x} \a"
+        self._test_expansion(in_string, r" \b+1  x+1")
+
+    def test_recursion(self):
+        with self.assertRaises(MacroRecursionError):
+            expand_macros(r"\def\a{\b}\def\b{x\a}\a")
+        with self.assertRaises(MacroRecursionError):
+            expand_macros(r"\newcommand{\f}[1]{\f{#1}}\f{x}")
+
+    def test_missing_argument(self):
+        with self.assertRaises(MacroError):
+            expand_macros(r"\newcommand{\f}[2]{#1#2}\f{x}")
+
+    def test_parses_expansion(self):
+        expansion = expand_macros(r"\newcommand{\sq}[1]{{#1}^{2}}\sq{x}+\sq{y}")
+        self.assertEqual(parse(expansion.text).rpn_string(), "x 2 expt y 2 expt +")
+
+    def test_parser_expands_on_request(self):
+        in_string = r"\newcommand{\sq}[1]{{#1}^{2}}\sq{x}+\sq{y}"
+        self.assertEqual(parse(in_string, macros=True).rpn_string(), "x 2 expt y 2 expt +")
+        self.assertEqual(compile_function(in_string, macros=True)(x=1.0, y=2.0), 5.0)
+
+        latex_parser = LatexParser(MacroExpander())
+        latex_parser.macros.define("half", 1, r"\frac{#1}{2}")
+        self.assertEqual(latex_parser.parse(r"\half{x}"), "x 2 prefix_div")
+
+
+class TestMacroSourceMap(unittest.TestCase):
+    """
+    Test that expanded text maps back to where it came from.
+    """
+
+    def test_offsets(self):
+        in_string = r"\def\sq#1{#1^{2}} \sq{y}+\sq{y}"
+        expansion = expand_macros(in_string)
+        self.assertEqual(expansion.text, " y^{2}+y^{2}")
+        first, second = [idx for idx, char in enumerate(in_string) if char == "y"]
+        self.assertEqual(expansion.offsets[1], first)
+        self.assertEqual(expansion.offsets[7], second)
+        # Body characters point at the invocation
+        self.assertEqual(expansion.offsets[2], in_string.index(r"\sq{y}"))
+        self.assertEqual(expansion.offsets[6], in_string.index("+"))
+        self.assertEqual(expansion.offsets[len(expansion.text)], len(in_string))
+
+    def test_token_offsets(self):
+        in_string = r"\newcommand{\inv}[1]{\frac{1}{#1}} a\inv{b}"
+        expansion = expand_macros(in_string)
+        lexer = Lexer()
+        lexer.lex(expansion.text)
+        offsets = expansion.token_offsets(lexer.token_index)
+        self.assertEqual(offsets["VAR_1"], in_string.index(" a") + 1)
+        self.assertEqual(offsets["VAR_2"], in_string.index("b}"))
+        self.assertEqual(offsets["BINOP_PRFIX_1"], in_string.index(r"\inv{"))
+
+
+class TestMacroMemoization(unittest.TestCase):
+    """
+    Test that each distinct invocation is expanded once.
+    """
+
+    def test_cache(self):
+        expander = MacroExpander()
+        expander.define("dd", 1, r"\frac{d}{d#1}")
+        in_string = " + ".join([r"\dd{t}", r"\dd{s}"] * 1000)
+        expansion = expander.expand(in_string)
+        self.assertEqual(expander.cache_info().misses, 2)
+        self.assertEqual(expander.cache_info().hits, 1998)
+        last = in_string.rindex("s")
+        self.assertEqual(expansion.offsets[expansion.text.rindex("s")], last)
+        expander.expand(r"\dd{t}")
+        self.assertEqual(expander.cache_info().misses, 2)
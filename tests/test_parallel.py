@@ -0,0 +1,54 @@
+""" Shared memory evaluation tests."""
+import unittest
+
+import numpy
+
+from latex_parser.parallel import SharedMemoryEvaluator
+from latex_parser.parser import compile_function
+
+
+class TestSharedMemoryEvaluator(unittest.TestCase):
+    """
+    Test that evaluating across processes matches evaluating in one.
+    """
+
+    def setUp(self):
+        self.formula = r"\sin(x)\exp(-y) + \frac{1}{2}"
+        self.evaluator = SharedMemoryEvaluator(self.formula, n_workers=3)
+        self.addCleanup(self.evaluator.close)
+
+    def test_matches_serial(self):
+        x = numpy.linspace(0, 10, 1001)
+        y = numpy.linspace(0, 1, 1001)
+        numpy.testing.assert_array_equal(
+            self.evaluator.evaluate(x=x, y=y), compile_function(self.formula)(x=x, y=y)
+        )
+        numpy.testing.assert_array_equal(
+            self.evaluator.evaluate(x=x, y=0.5), compile_function(self.formula)(x=x, y=0.5)
+        )
+
+    def test_shared_inputs_and_output(self):
+        x = self.evaluator.allocate(1001)
+        x[:] = numpy.linspace(0, 10, 1001)
+        out = self.evaluator.allocate(1001)
+        n_segments = len(self.evaluator._segments)
+        self.assertIs(self.evaluator.evaluate(out=out, x=x, y=0.0), out)
+        self.assertEqual(len(self.evaluator._segments), n_segments)
+        numpy.testing.assert_array_equal(out, numpy.sin(x) + 0.5)
+        with self.assertRaises(ValueError):
+            self.evaluator.evaluate(out=numpy.empty(1001), x=x, y=0.0)
+
+    def test_matrix_rows(self):
+        with SharedMemoryEvaluator(r"\begin{pmatrix} t & 1 \\ 0 & t \end{pmatrix}^{2}", n_workers=2) as evaluator:
+            result = evaluator.evaluate(t=numpy.arange(5.0))
+            self.assertEqual(result.shape, (5, 2, 2))
+            numpy.testing.assert_array_equal(result[3], [[9, 6], [0, 9]])
+            del result
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.evaluator.evaluate(x=numpy.ones(3), y=numpy.ones(4))
+        with self.assertRaises(ValueError):
+            self.evaluator.evaluate(x=1.0, y=2.0)
+        with self.assertRaises(ValueError):
+            SharedMemoryEvaluator("x", dtype="fraction")
@@ -0,0 +1,157 @@
+""" Parser tests."""
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from latex_parser.algorithms import MalformedEnvironmentError
+from latex_parser.parser import LatexParser, parse, parse_many, parse_parallel
+
+
+class TestParse(unittest.TestCase):
+    """
+    Test that latex is parsed into reverse polish notation.
+    """
+
+    def test_parses_precedence(self):
+        self.assertEqual(parse(r"(1+3) * (2+4)").rpn_string(), "1 3 + 2 4 + *")
+        self.assertEqual(parse(r"1+3*2").rpn_string(), "1 3 2 * +")
+        self.assertEqual(parse(r"2^3^2").rpn_string(), "2 3 2 expt expt")
+        self.assertEqual(parse(r"8-3-2").rpn_string(), "8 3 - 2 -")
+
+    def test_parses_functions(self):
+        self.assertEqual(
+            parse(r"3*\sin(\pi^2)+1").rpn_string(), r"3 \pi 2 expt sin * 1 +"
+        )
+        self.assertEqual(
+            parse(r"\frac{1}{x}^{2}").rpn_string(), "1 x prefix_div 2 expt"
+        )
+
+    def test_parses_unary_minus_and_implicit_products(self):
+        self.assertEqual(parse(r"-x^2").rpn_string(), "x 2 expt neg")
+        self.assertEqual(parse(r"2x(y+1)").rpn_string(), "2 x * y 1 + *")
+        self.assertEqual(parse(r"\frac{a}{b}c").rpn_string(), "a b prefix_div c *")
+
+    def test_result_is_immutable(self):
+        result = parse(r"x+1")
+        with self.assertRaises(TypeError):
+            result.symbol_mapping["VAR_1"] = "y"
+
+
+class TestThreadedParse(unittest.TestCase):
+    """
+    Test that parsing gives the same results from many threads.
+    """
+
+    def setUp(self):
+        self.formulas = [rf"\sin(x_{{{idx}}}) + {idx}y^{{2}}" for idx in range(200)]
+
+    def test_parse_many_matches_serial(self):
+        parse.cache_clear()
+        threaded = parse_many(self.formulas, max_workers=8)
+        parse.cache_clear()
+        serial = [parse(formula) for formula in self.formulas]
+        self.assertEqual(threaded, serial)
+
+    def test_shared_parser(self):
+        latex_parser = LatexParser()
+        expected = {formula: latex_parser.parse(formula) for formula in self.formulas}
+        parse.cache_clear()
+        barrier = threading.Barrier(8)
+
+        def _parse_all(offset):
+            barrier.wait()
+            formulas = self.formulas[offset:] + self.formulas[:offset]
+            return [(f, latex_parser.parse(f)) for f in formulas]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for results in executor.map(_parse_all, range(0, 200, 25)):
+                for formula, rpn_string in results:
+                    self.assertEqual(rpn_string, expected[formula])
+
+
+class TestParallelParse(unittest.TestCase):
+    """
+    Test that parsing the terms of one string in processes matches the serial parse.
+    """
+
+    def test_matches_serial(self):
+        for parse_string in [
+            r"a+b - \frac{1+2}{3}\sin(x-1) -\pi - 2 \cdot -3 + \sum_{i=1}^{n} i",
+            r"\sin - x + \begin{pmatrix} 1 & -2 \end{pmatrix} - \left( y - z \right)",
+            r"\begin{cases} 1 & x < 0 \\ 2 & \text{otherwise} \end{cases} + x - y",
+            "x + 1 < 2",
+            r"\text{a} - x + y",
+            r"\theta_0 + 1",
+            r"\alpha_{1} - x",
+            r"\log_2 - x",
+            r"a - \log_{2} - x",
+            r"x_{1} - \pi - y_2 + \frac{a}{b_{1}} - 1",
+        ]:
+            self.assertEqual(
+                parse_parallel(parse_string, max_workers=2, min_length=0), parse(parse_string)
+            )
+
+    def test_huge_string(self):
+        parse_string = " - ".join(rf"\sin(x_{{{idx}}}) + {idx}y^{{2}}" for idx in range(100))
+        result = parse_parallel(parse_string, max_workers=2, min_length=0)
+        self.assertEqual(result, parse(parse_string))
+
+
+class TestLatexParser(unittest.TestCase):
+    def setUp(self):
+        self.parser = LatexParser()
+
+    def test_to_ast(self):
+        tree = self.parser.to_ast(r"\frac{1}{x_{1}}+2")
+        self.assertEqual(eval(compile(tree, "<latex>", "eval"), {"x_1": 4}), 2.25)
+
+
+class TestParseBigOperators(unittest.TestCase):
+    def test_parses_sum(self):
+        self.assertEqual(
+            parse(r"\sum_{i=1}^{n} i^2 + 1").rpn_string(), "i 1 n i 2 expt sum 1 +"
+        )
+        self.assertEqual(
+            parse(r"2\prod_{k=0}^{m+1} 2k").rpn_string(), "2 k 0 m 1 + 2 k * prod *"
+        )
+
+
+class TestParseMatrices(unittest.TestCase):
+    def test_parses_matrix_product(self):
+        self.assertEqual(
+            parse(
+                r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}"
+                r"\begin{bmatrix} x \\ y+1 \\ \end{bmatrix}"
+            ).rpn_string(),
+            "a b c d 2x2 x y 1 + 2x1 *",
+        )
+
+    def test_malformed_matrices(self):
+        with self.assertRaises(MalformedEnvironmentError):
+            parse(r"\begin{pmatrix} a & b \\ c \end{pmatrix}")
+        with self.assertRaises(MalformedEnvironmentError):
+            parse(r"\begin{pmatrix} a & \end{pmatrix}")
+        with self.assertRaises(MalformedEnvironmentError):
+            parse(r"\begin{vmatrix} a \end{vmatrix}")
+        with self.assertRaises(MalformedEnvironmentError):
+            parse(r"\begin{pmatrix} a ")
+
+
+class TestParseCases(unittest.TestCase):
+    def test_parses_cases(self):
+        self.assertEqual(
+            parse(
+                r"\begin{cases} x^{2} & x < 0 \\ \ln(x) & \text{if } x \geq 1, "
+                r"\\ 0 & \text{otherwise} \end{cases} + 1"
+            ).rpn_string(),
+            "x 2 expt x 0 < x nat_log x 1 >= 0 1 cases3 1 +",
+        )
+        self.assertEqual(parse(r"0 < x+1 \le 2").rpn_string(), "0 x 1 + < 2 <=")
+
+    def test_malformed_cases(self):
+        with self.assertRaises(MalformedEnvironmentError):
+            parse(r"\begin{cases} 1 & \text{otherwise} \\ 2 & x > 0 \end{cases}")
+        with self.assertRaises(MalformedEnvironmentError):
+            parse(r"\begin{cases} 1 & x > 0 & y \end{cases}")
+        with self.assertRaises(MalformedEnvironmentError):
+            parse(r"\begin{cases} & x > 0 \end{cases}")
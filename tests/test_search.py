@@ -0,0 +1,107 @@
+""" Structural search tests."""
+import os
+import tempfile
+import unittest
+
+from latex_parser.parser import parse
+from latex_parser.search import FormulaIndex, extract_math, structural_hashes
+
+_DOCUMENT = r"""
+\section{Limits}
+We know $\lim \frac{\sin(t)}{t} = 1$ and, for the other variable,
+\begin{equation}
+    f(x) = 3 + \frac{\sin(y)}{y} \\
+    g = \frac{\sin(y)}{z}
+\end{equation}
+and \[ \sin(x)/x + 1 \] and $( broken $.
+"""
+
+
+class TestStructuralHashes(unittest.TestCase):
+    def _root_hash(self, in_string):
+        result = parse(in_string)
+        return structural_hashes(result.rpn, result.symbol_mapping)[-1]
+
+    def test_alpha_renaming(self):
+        self.assertEqual(self._root_hash(r"\sin(x)+x"), self._root_hash(r"\sin(t)+t"))
+        self.assertNotEqual(self._root_hash(r"\sin(x)+x"), self._root_hash(r"\sin(x)+y"))
+        self.assertNotEqual(self._root_hash(r"x+1"), self._root_hash(r"x+2"))
+
+    def test_division_spellings(self):
+        self.assertEqual(self._root_hash(r"\frac{a}{b}"), self._root_hash(r"a/b"))
+
+
+class TestFormulaIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = FormulaIndex(os.path.join(self.directory.name, "index.db"))
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+
+    def test_extract_math(self):
+        formulas = [latex.strip() for _, latex in extract_math(_DOCUMENT)]
+        self.assertIn(r"\lim \frac{\sin(t)}{t}", formulas)
+        self.assertIn(r"3 + \frac{\sin(y)}{y}", formulas)
+        self.assertIn(r"\sin(x)/x + 1", formulas)
+        for offset, latex in extract_math(_DOCUMENT):
+            self.assertEqual(_DOCUMENT[offset:offset + len(latex)], latex)
+
+    def test_search(self):
+        self.index.add_document("limits.tex", _DOCUMENT)
+        matches = self.index.search(r"\frac{\sin(x)}{x}")
+        self.assertEqual(
+            [match.latex.strip() for match in matches],
+            [r"\lim \frac{\sin(t)}{t}", r"3 + \frac{\sin(y)}{y}", r"\sin(x)/x + 1"],
+        )
+        self.assertEqual(self.index.search(r"\sin(x)/y")[0].latex.strip(), r"\frac{\sin(y)}{z}")
+        with self.assertRaises(ValueError):
+            self.index.search("x")
+
+    def test_add_paths(self):
+        tex_path = os.path.join(self.directory.name, "limits.tex")
+        with open(tex_path, "w") as tex_file:
+            tex_file.write(_DOCUMENT)
+        self.assertEqual(self.index.add_paths([self.directory.name]), 1)
+        self.assertEqual(self.index.add_paths([self.directory.name]), 0)
+        self.assertEqual(len(self.index.search(r"\frac{\sin(x)}{x}")), 3)
+
+    def test_sum(self):
+        document = r"Sums $\sum_{i=1}^{n}\sin(i) = s$ end"
+        self.assertEqual(
+            [latex.strip() for _, latex in extract_math(document)], [r"\sum_{i=1}^{n}\sin(i)", "s"]
+        )
+        self.index.add_document("sums.tex", document)
+        matches = self.index.search(r"\sin(x)")
+        self.assertEqual([match.offset for match in matches], [document.index("\\sum")])
+
+    def test_matrix(self):
+        document = (
+            r"Rotation $R = \begin{pmatrix} \cos(t) & -\sin(t) \\ "
+            r"\sin(t) & \cos(t) \end{pmatrix}$"
+        )
+        formulas = [latex.strip() for _, latex in extract_math(document)]
+        self.assertEqual(formulas[0], "R")
+        self.assertTrue(formulas[1].endswith(r"\end{pmatrix}"))
+        self.index.add_document("rotation.tex", document)
+        matches = self.index.search(r"\sin(x)")
+        self.assertEqual([match.offset for match in matches], [document.index("=") + 1])
+
+    def test_cases(self):
+        document = (
+            r"Let $f(x) = \begin{cases} \ln(x) & x > 0 \\ "
+            r"0 & \text{otherwise} \end{cases}$ be"
+        )
+        formulas = [latex.strip() for _, latex in extract_math(document)]
+        self.assertEqual(formulas[0], "f(x)")
+        self.assertTrue(formulas[1].startswith(r"\begin{cases}"))
+        self.index.add_document("piecewise.tex", document)
+        matches = self.index.search(r"\ln(y)")
+        self.assertEqual([match.offset for match in matches], [document.index("=") + 1])
+
+    def test_expands_macros(self):
+        document = r"\newcommand{\sinc}[1]{\frac{\sin(#1)}{#1}} Text $2\sinc{u}$"
+        self.index.add_document("macros.tex", document)
+        matches = self.index.search(r"\frac{\sin(x)}{x}")
+        self.assertEqual([match.offset for match in matches], [document.index("2")])
@@ -0,0 +1,108 @@
+""" Serialization tests."""
+import ast
+import pickle
+import sys
+import unittest
+
+from latex_parser.lexer import lex
+from latex_parser.parser import LatexParser, parse
+from latex_parser.serialization import (
+    PackedExpression,
+    SerializationError,
+    pack_rpn,
+    pack_tokens,
+    pack_tree,
+)
+from latex_parser.utilities import rpn_to_ast
+
+
+class TestSerialization(unittest.TestCase):
+    """
+    Test that packed expressions round-trip.
+    """
+
+    def setUp(self):
+        self.in_string = r"\sin(x^{2}+1) + \ln(\frac{1}{x}) - 2y"
+
+    def test_lexer_tokens_round_trip(self):
+        tokens, mapping = lex(self.in_string)
+        packed = PackedExpression(pack_tokens(tokens, mapping))
+        unpacked_tokens, unpacked_mapping = packed.tokens()
+        self.assertEqual(unpacked_tokens, tokens)
+        self.assertEqual(
+            unpacked_mapping, {token: mapping[token] for token in tokens if token in mapping}
+        )
+
+    def test_rpn_round_trip(self):
+        result = parse(self.in_string)
+        packed = PackedExpression(pack_rpn(result.rpn, result.symbol_mapping))
+        rpn, mapping = packed.tokens()
+        self.assertEqual(rpn, list(result.rpn))
+        self.assertEqual(mapping, dict(result.symbol_mapping))
+        # x is interned once
+        self.assertEqual(packed.n_symbols, len(set(result.symbol_mapping.values())))
+
+    def test_tree_round_trip(self):
+        tree = LatexParser().to_ast(r"3*\sin(\pi^2)+\frac{1}{-x}")
+        packed = PackedExpression(pack_tree(tree))
+        self.assertEqual(ast.dump(packed.to_ast()), ast.dump(tree))
+
+    def test_children(self):
+        result = parse(r"\frac{a+b}{c}")
+        packed = PackedExpression(pack_rpn(result.rpn, result.symbol_mapping))
+        # a b + c prefix_div
+        self.assertEqual(packed.children(4), [2, 3])
+        self.assertEqual(packed.children(2), [0, 1])
+        self.assertEqual(packed.first_children[4], 0)
+
+    def test_zero_copy(self):
+        result = parse(self.in_string)
+        buffer = bytearray(pack_rpn(result.rpn, result.symbol_mapping))
+        packed = PackedExpression(buffer)
+        self.assertIs(packed.opcodes.obj, buffer)
+        self.assertEqual(pickle.loads(pickle.dumps(bytes(buffer))), bytes(buffer))
+        # Writes to the buffer show through the loaded arrays
+        self.assertNotEqual(set(packed.opcodes), {0})
+        buffer[:] = bytes(len(buffer))
+        self.assertEqual(set(packed.opcodes), {0})
+        if sys.byteorder == "little":
+            self.assertEqual(set(packed.first_children), {0})
+
+    def test_rejects_bad_buffers(self):
+        with self.assertRaises(SerializationError):
+            PackedExpression(b"LX")
+        with self.assertRaises(SerializationError):
+            PackedExpression(b"NOPE" + bytes(16))
+        result = parse(self.in_string)
+        with self.assertRaises(SerializationError):
+            PackedExpression(pack_rpn(result.rpn, result.symbol_mapping)[:-4])
+
+    def test_big_operator_tree_round_trip(self):
+        tree = LatexParser().to_ast(r"\sum_{i=1}^{n} \prod_{j=1}^{i} x j")
+        packed = PackedExpression(pack_tree(tree))
+        self.assertEqual(ast.dump(packed.to_ast()), ast.dump(tree))
+
+    def test_matrix_tree_round_trip(self):
+        tree = LatexParser().to_ast(
+            r"2\begin{pmatrix} a & b \\ c & d \end{pmatrix}^{2}\begin{pmatrix} x \\ y \end{pmatrix}"
+        )
+        packed = PackedExpression(pack_tree(tree))
+        self.assertEqual(ast.dump(packed.to_ast()), ast.dump(tree))
+
+    def test_large_matrix_round_trip(self):
+        rows = r" \\ ".join(
+            " & ".join(f"x_{{{row}{column}}}" for column in range(20)) for row in range(20)
+        )
+        result = parse(rf"\begin{{pmatrix}} {rows} \end{{pmatrix}}")
+        packed = PackedExpression(pack_rpn(result.rpn, result.symbol_mapping))
+        self.assertEqual(packed.arities[len(packed) - 1], 400)
+        self.assertEqual(packed.tokens(), (list(result.rpn), dict(result.symbol_mapping)))
+        tree = rpn_to_ast(result.rpn, result.symbol_mapping)
+        self.assertEqual(ast.dump(PackedExpression(pack_tree(tree)).to_ast()), ast.dump(tree))
+
+    def test_cases_tree_round_trip(self):
+        tree = LatexParser().to_ast(
+            r"\begin{cases} \ln(x) & 0 < x \le 1 \\ 0 & x = 0 \\ -x & \text{otherwise} \end{cases}"
+        )
+        packed = PackedExpression(pack_tree(tree))
+        self.assertEqual(ast.dump(packed.to_ast()), ast.dump(tree))
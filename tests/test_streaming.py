@@ -0,0 +1,64 @@
+""" Streaming evaluation tests."""
+import asyncio
+import unittest
+
+import numpy
+
+from latex_parser.parser import compile_function
+from latex_parser.streaming import StreamingEvaluator
+
+
+class TestStreamingEvaluator(unittest.TestCase):
+    """
+    Test that appended rows evaluate as the whole history would.
+    """
+
+    def setUp(self):
+        self.formula = r"\frac{x - m}{s} + \sin(y)"
+        self.evaluator = StreamingEvaluator(self.formula, m=0.5, s=2.0)
+
+    def test_matches_batch_evaluation(self):
+        x = numpy.linspace(0, 10, 3000)
+        y = numpy.linspace(0, 1, 3000)
+        results = [self.evaluator.append(x=x[0], y=y[0])]
+        for start, stop in [(1, 10), (10, 2500), (2500, 3000)]:
+            results.append(self.evaluator.append(x=x[start:stop], y=y[start:stop]))
+        self.assertEqual([len(result) for result in results], [1, 9, 2490, 500])
+        self.assertEqual(self.evaluator.n_rows, 3000)
+        numpy.testing.assert_array_equal(
+            numpy.concatenate(results), compile_function(self.formula)(x=x, y=y, m=0.5, s=2.0)
+        )
+
+    def test_results_do_not_alias_inputs(self):
+        x = numpy.array([1.0, 2.0])
+        result = StreamingEvaluator("x").append(x=x)
+        x[:] = 0.0
+        numpy.testing.assert_array_equal(result, [1.0, 2.0])
+
+    def test_constant_formula(self):
+        evaluator = StreamingEvaluator("a + 1", a=2.0)
+        numpy.testing.assert_array_equal(evaluator.append(), [3.0])
+
+    def test_bad_batches(self):
+        with self.assertRaises(ValueError):
+            self.evaluator.append(x=1.0)
+        with self.assertRaises(ValueError):
+            self.evaluator.append(x=[1.0, 2.0], y=[1.0])
+        with self.assertRaises(ValueError):
+            StreamingEvaluator(self.formula, z=1.0)
+        with self.assertRaises(ValueError):
+            StreamingEvaluator(self.formula, dtype="fraction")
+
+    def test_stream(self):
+        async def feed():
+            for start in range(0, 100, 30):
+                yield {"x": numpy.arange(start, min(start + 30, 100)), "y": 0.0}
+
+        async def collect():
+            return [results async for results in self.evaluator.stream(feed())]
+
+        results = asyncio.run(collect())
+        self.assertEqual([len(result) for result in results], [30, 30, 30, 10])
+        numpy.testing.assert_array_equal(
+            numpy.concatenate(results), (numpy.arange(100) - 0.5) / 2.0
+        )